@@ -0,0 +1,249 @@
+"""
+batch_process.py
+script to process a whole directory (or glob) of coding manual PDFs without prompting
+manuals are processed concurrently across a pool of worker processes
+a failure on one manual is recorded and does not stop the others
+writes a json run manifest (status, timings and output path of every manual)
+"""
+
+import argparse
+import glob
+import json
+import os
+import time
+import traceback
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from fhs_utility.misc import make_dir, date_ext
+import instrumentation
+from document_session import document_session
+from output_writers import OUTPUT_WRITERS, check_output_formats
+from page_budgets import DEFAULT_PAGE_SECONDS, Budget, BudgetExceeded
+from word_backends import DEFAULT_WORD_BACKEND, WORD_BACKENDS
+
+def find_pdfs(path):
+    """
+    takes str representing a directory or a glob pattern
+    returns sorted list of paths to PDFs in directory / matching pattern
+    """
+    if os.path.isdir(path):
+        fps = [os.path.join(path, file) for file in os.listdir(path)]
+    else:
+        fps = glob.glob(path, recursive=True)
+
+    return sorted(fp for fp in fps if os.path.isfile(fp) and fp.lower().endswith('.pdf'))
+
+def detect_format(pdf_fp):
+    """
+    takes str representing path to coding manual PDF
+    returns 'current' if manual is in the currently used format, else 'old'
+        current format manuals have a 'FHS Coding Manual for ...' footer on the title page
+        and/or 'Variable name:' headers within the first few pages
+    """
+    with document_session(pdf_fp) as session:
+        for pg_num in range(min(3, session.num_pages)):
+            text = session.pdf.pages[pg_num].extract_text() or ''
+            session.release_page(pg_num)
+            if 'Variable name:' in text or (pg_num == 0 and 'FHS Coding Manual for' in text):
+                return 'current'
+
+    return 'old'
+
+def new_manifest_entry(pdf_fp, manual_format):
+    """
+    returns manifest entry (dict) for a manual that has not been processed yet
+    """
+    return {'pdf': pdf_fp,
+            'format': manual_format,
+            'status': None,
+            'output': None,
+            'error': None,
+            'traceback': None,
+            'started': None,
+            'seconds': None,
+            'peak_rss_mb': None,
+            'degraded_pages': {},
+            'skipped_table_pages': 0,
+            'skipped_table_seconds': 0.0}
+
+def process_manual(pdf_fp, manual_format='auto', text_source='ocr', output_formats=('xlsx',),
+                   word_backend=DEFAULT_WORD_BACKEND, page_seconds=DEFAULT_PAGE_SECONDS,
+                   document_seconds=None):
+    """
+    takes str representing path to coding manual PDF
+    writes its xlsx data dictionary with the pipeline for its format
+        manual_format: 'current', 'old' or 'auto' (see detect_format)
+        text_source: passed on to write_pdf_vars_to_xlsx for current format manuals
+        output_formats: formats data dictionary is written in (see output_writers)
+        word_backend: how words are pulled from pages (see word_backends)
+        page_seconds, document_seconds: time budgets of a page's table finding / ocr and of the
+            manual (None = no limit), see page_budgets.py (current format only)
+    returns manifest entry (dict) for the manual, never raises
+        'degraded_pages': page number -> how page went over budget
+        'skipped_table_pages', 'skipped_table_seconds': pages that could not hold a table and
+            were not searched for one, estimated seconds that saved (see
+            extract_tables_and_var_names.get_table_search_skip_reason)
+    the PDF is opened once, for format detection and the pipeline (see document_session.py)
+    """
+    entry = new_manifest_entry(pdf_fp, manual_format)
+    entry['started'] = date_ext(full=True)
+    start = time.perf_counter()
+    try:
+        with document_session(pdf_fp, word_backend,
+                              Budget(page_seconds, document_seconds)) as session:
+            if manual_format == 'auto':
+                entry['format'] = detect_format(pdf_fp)
+
+            match entry['format']:
+                case 'current':
+                    from cmanual_pdf_to_data_dict import write_pdf_vars_to_xlsx
+                    from extract_tables_and_var_names import estimate_skipped_table_seconds
+                    entry['output'] = write_pdf_vars_to_xlsx(pdf_fp, text_source=text_source,
+                                                             output_formats=output_formats,
+                                                             word_backend=word_backend)
+                    entry['degraded_pages'] = {pg_num+1: reasons for pg_num, reasons
+                                               in sorted(session.degraded.items())}
+                    entry['skipped_table_pages'] = sum(
+                        skip_reason is not None
+                        for skip_reason, _ in session.table_searches.values())
+                    entry['skipped_table_seconds'] = round(
+                        estimate_skipped_table_seconds(session.table_searches), 3)
+                case 'old':
+                    from old_format_cmanual_pdf_to_data_dict import process_pdf
+                    entry['output'] = process_pdf(pdf_fp, output_formats=output_formats,
+                                                  word_backend=word_backend)
+                case _:
+                    raise ValueError(f'unknown manual format: {entry['format']}')
+    except (Exception, BudgetExceeded) as e: # budget overruns are BaseExceptions
+        entry['status'] = 'failed'
+        entry['error'] = f'{type(e).__name__}: {e}'
+        entry['traceback'] = traceback.format_exc()
+    else:
+        entry['status'] = 'ok'
+    entry['seconds'] = round(time.perf_counter() - start, 3)
+    entry['peak_rss_mb'] = instrumentation.get_peak_rss_mb() # of the process, so far
+
+    return entry
+
+def run_batch(pdf_fps, workers=1, manual_format='auto', text_source='ocr',
+              output_formats=('xlsx',), word_backend=DEFAULT_WORD_BACKEND,
+              page_seconds=DEFAULT_PAGE_SECONDS, document_seconds=None):
+    """
+    takes list of paths to coding manual PDFs
+    processes manuals (see process_manual) across that many worker processes
+    returns list of manifest entries, in order of pdf_fps
+    """
+    entries = {}
+    if workers <= 1:
+        for pdf_fp in pdf_fps:
+            entries[pdf_fp] = process_manual(pdf_fp, manual_format, text_source, output_formats,
+                                             word_backend, page_seconds, document_seconds)
+            print(f'[{entries[pdf_fp]['status']}] {pdf_fp} ({entries[pdf_fp]['seconds']}s)')
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = {executor.submit(process_manual, pdf_fp, manual_format, text_source,
+                                       output_formats, word_backend, page_seconds,
+                                       document_seconds): pdf_fp
+                       for pdf_fp in pdf_fps}
+            for future in as_completed(futures):
+                pdf_fp = futures[future]
+                try:
+                    entries[pdf_fp] = future.result()
+                except (Exception, BudgetExceeded) as e:
+                    # worker itself died (e.g. killed for memory), not caught by process_manual
+                    entries[pdf_fp] = new_manifest_entry(pdf_fp, manual_format)
+                    entries[pdf_fp]['status'] = 'failed'
+                    entries[pdf_fp]['error'] = f'{type(e).__name__}: {e}'
+                print(f'[{entries[pdf_fp]['status']}] {pdf_fp} ({entries[pdf_fp]['seconds']}s)')
+
+    return [entries[pdf_fp] for pdf_fp in pdf_fps]
+
+def write_manifest(manifest_fp, entries, seconds):
+    """
+    takes str representing path of manifest, output of run_batch and total run time
+    writes json run manifest
+    """
+    manifest = {'finished': date_ext(full=True),
+                'seconds': round(seconds, 3),
+                'num_ok': sum(entry['status'] == 'ok' for entry in entries),
+                'num_failed': sum(entry['status'] != 'ok' for entry in entries),
+                'manuals': entries}
+
+    manifest_dir = os.path.dirname(manifest_fp)
+    if manifest_dir:
+        make_dir(manifest_dir)
+    with open(manifest_fp, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, indent=2)
+
+def main():
+    """
+    command line entry point, see --help
+    """
+    parser = argparse.ArgumentParser(description='Create xlsx data dictionaries for a batch of '
+                                                 'coding manual PDFs.')
+    parser.add_argument('path', help='directory of PDFs or glob pattern (e.g. "PDFs/**/*.pdf")')
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1,
+                        help='number of manuals processed at once (default: number of CPUs)')
+    parser.add_argument('--format', dest='manual_format', default='auto',
+                        choices=['auto', 'current', 'old'], help='coding manual format')
+    parser.add_argument('--text-source', default='ocr', choices=['ocr', 'hybrid', 'regions'],
+                        help='description text source for current format manuals')
+    parser.add_argument('--output-formats', nargs='+', default=['xlsx'],
+                        choices=list(OUTPUT_WRITERS),
+                        help='formats to write data dictionaries in (default: xlsx)')
+    parser.add_argument('--word-backend', default=DEFAULT_WORD_BACKEND, choices=list(WORD_BACKENDS),
+                        help=f'how words are pulled from pages (default: {DEFAULT_WORD_BACKEND}, '
+                             f'pymupdf is much faster, see word_backends.py)')
+    parser.add_argument('--page-seconds', type=float, default=DEFAULT_PAGE_SECONDS,
+                        help=f'time budget of one page\'s table finding / ocr before it is read a '
+                             'cheaper way (default: no limit)')
+    parser.add_argument('--document-seconds', type=float, default=None,
+                        help='time budget of one manual, pages left once it is spent are read the '
+                             'cheaper way (default: no limit)')
+    parser.add_argument('--manifest', default=None,
+                        help='path of json run manifest (default: output/<date>/manifest_<time>.json)')
+    parser.add_argument('--trace', default=None,
+                        help='path of chrome trace (json) of stage timings to write (off by default)')
+    args = parser.parse_args()
+
+    pdf_fps = find_pdfs(args.path)
+    if not pdf_fps:
+        parser.error(f'no PDFs found at {args.path}')
+    try:
+        check_output_formats(args.output_formats)
+    except ImportError as e:
+        parser.error(str(e))
+
+    manifest_fp = args.manifest or os.path.join('output', date_ext(),
+                                                f'manifest_{date_ext(full=True)}.json')
+
+    if args.trace:
+        instrumentation.enable()
+
+    print(f'Processing {len(pdf_fps)} PDFs with {args.workers} workers...')
+    start = time.perf_counter()
+    entries = run_batch(pdf_fps, workers=args.workers, manual_format=args.manual_format,
+                        text_source=args.text_source, output_formats=args.output_formats,
+                        word_backend=args.word_backend,
+                        page_seconds=args.page_seconds or None,
+                        document_seconds=args.document_seconds)
+    write_manifest(manifest_fp, entries, time.perf_counter() - start)
+
+    if args.trace:
+        instrumentation.write_trace(args.trace)
+        instrumentation.disable()
+        print(f'Trace written to {args.trace}')
+
+    num_failed = sum(entry['status'] != 'ok' for entry in entries)
+    num_skipped = sum(entry['skipped_table_pages'] for entry in entries)
+    if num_skipped:
+        skipped_seconds = sum(entry['skipped_table_seconds'] for entry in entries)
+        print(f'Skipped table finding on {num_skipped} pages that could not hold a table '
+              f'(~{skipped_seconds:.2f}s saved, see skipped_table_pages in manifest)')
+    num_degraded = sum(len(entry['degraded_pages']) for entry in entries)
+    if num_degraded:
+        print(f'{num_degraded} pages went over budget (see degraded_pages in manifest)')
+    print(f'Done! {len(entries) - num_failed} ok, {num_failed} failed (manifest: {manifest_fp})')
+    return 1 if num_failed else 0
+
+if __name__ == '__main__':
+    raise SystemExit(main())
@@ -0,0 +1,541 @@
+"""
+benchmark.py
+script for measuring performance of the coding manual pipelines
+    - xlsx: time write_variables_to_xlsx on increasing numbers of (synthetic) variables
+    - corpus: run both pipelines over the bundled PDFs, per-stage timings, pages/sec and
+      peak memory of every manual, saved as json and checked against a baseline
+    - startup: import time of every entry point, and a check that none loads the ocr/imaging
+      stack it does not need
+    - words: throughput of every word backend over the bundled PDFs, and a parity check that
+      the pipelines make the same of each backend's words
+"""
+
+import argparse
+import contextlib
+import difflib
+import functools
+import importlib
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+import multiprocessing
+import pdfplumber
+from fhs_utility.misc import make_dir, date_ext
+from cmanual_pdf_to_data_dict import write_variables_to_xlsx
+from document_session import document_session
+from instrumentation import get_peak_rss_mb
+from variable import Variable
+from word_backends import DEFAULT_WORD_BACKEND, WORD_BACKENDS
+
+# (module, function, stage) timed by the corpus benchmark, per format
+# a stage's time excludes time spent in the other stages it calls
+CURRENT_FORMAT_STAGES = [
+    ('cmanual_pdf_to_data_dict', 'ocr_document_page', 'render'),
+    ('cmanual_pdf_to_data_dict', 'ocr_page_image', 'render'),
+    ('cmanual_pdf_to_data_dict', 'ocr_image', 'ocr'),
+    ('cmanual_pdf_to_data_dict', 'read_page_text_layer', 'text layer'),
+    ('extract_tables_and_var_names', 'get_tables_on_page_by_ycoord', 'table finding'),
+    ('extract_tables_and_var_names', 'get_varnames_on_page_by_ycoord', 'name extraction'),
+    ('cmanual_pdf_to_data_dict', 'map_var_to_table', 'matching'),
+    ('cmanual_pdf_to_data_dict', 'read_description', 'descriptions'),
+    ('cmanual_pdf_to_data_dict', 'write_variables', 'xlsx write'),
+]
+OLD_FORMAT_STAGES = [
+    ('old_format_cmanual_pdf_to_data_dict', 'read_words_and_locations_on_page', 'words'),
+    ('old_format_cmanual_pdf_to_data_dict', 'extract_pdf_var_names', 'name extraction'),
+    ('old_format_cmanual_pdf_to_data_dict', 'extract_var_text', 'matching'),
+    ('old_format_cmanual_pdf_to_data_dict', 'parse_var_text', 'descriptions'),
+    ('old_format_cmanual_pdf_to_data_dict', 'write_variables', 'xlsx write'),
+]
+
+# entry point -> heavy modules importing it must not load (they are imported when first used)
+STARTUP_ENTRY_POINTS = {
+    'old_format_cmanual_pdf_to_data_dict': ['cv2', 'pytesseract', 'pymupdf'],
+    'cmanual_pdf_to_data_dict': ['cv2', 'pytesseract'],
+    'batch_process': ['cv2', 'pytesseract', 'pymupdf'],
+    'extraction_service': ['cv2', 'pytesseract', 'pymupdf'],
+}
+STARTUP_REPORTED_MODULES = ['cv2', 'pytesseract', 'pymupdf', 'numpy', 'pandas', 'pdfplumber']
+
+# word boxes of different backends within this many points of each other count as the same
+WORD_BOX_TOLERANCE = 1
+
+# stages shorter than this (in baseline and run) are too noisy to flag as regressions
+MIN_COMPARED_SECONDS = 0.25
+
+def make_synthetic_variables(num_vars):
+    """
+    returns list of num_vars Variable objects shaped like those in real manuals
+        (every other variable has a coded values table with counts)
+    """
+    variables = []
+    for i in range(num_vars):
+        values = None
+        if i % 2 == 0:
+            values = {str(code): {'Description': f'Coded value {code} of variable {i}',
+                                  'Count': str(10*code + 1)} for code in range(8)}
+            values['9999'] = {'Description': 'Unknown', 'Count': '3'}
+        variables.append(Variable(f'VAR{i}', f'Description of variable {i} Units: mg/dL',
+                                  values, 5000))
+
+    return variables
+
+def benchmark_xlsx_writer(sizes=(500, 1000, 2000, 4000, 8000)):
+    """
+    times write_variables_to_xlsx for each number of variables in sizes
+    prints seconds and microseconds per variable (flat per-variable cost = linear scaling)
+    returns list of (num variables, seconds)
+    """
+    results = []
+    cwd = os.getcwd()
+    work_dir = tempfile.mkdtemp()
+    try:
+        os.chdir(work_dir) # write_variables_to_xlsx writes into ./output
+        for num_vars in sizes:
+            variables = make_synthetic_variables(num_vars)
+            start = time.perf_counter()
+            write_variables_to_xlsx(f'benchmark_{num_vars}.pdf', variables)
+            seconds = time.perf_counter() - start
+            results.append((num_vars, seconds))
+            print(f'{num_vars:>7} variables: {seconds:8.3f}s '
+                  f'({1e6*seconds/num_vars:7.1f} us/variable)')
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    return results
+
+def time_stages(stages, timings):
+    """
+    takes list of (module, function, stage) and dict to accumulate seconds per stage in
+    replaces each function with a wrapper timing its calls (in this process only)
+        nested calls of other timed functions count towards their own stage only
+    """
+    local = threading.local() # active: time spent in nested stages, per timed call in progress
+    lock = threading.Lock()
+
+    def timed(func, stage):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not hasattr(local, 'active'):
+                local.active = [] # stages can run in threads of their own
+            local.active.append(0.0)
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                seconds = time.perf_counter() - start
+                nested = local.active.pop()
+                with lock:
+                    timings[stage] = timings.get(stage, 0.0) + seconds - nested
+                if local.active:
+                    local.active[-1] += seconds
+        return wrapper
+
+    for module_name, func_name, stage in stages:
+        module = importlib.import_module(module_name)
+        setattr(module, func_name, timed(getattr(module, func_name), stage))
+
+def stub_image_to_string(image, *args, **kwargs):
+    """
+    stand-in for pytesseract.image_to_string (no Tesseract needed, reads no text)
+    """
+    return ''
+
+def list_corpus(pdf_dir='PDFs', formats=('current', 'old')):
+    """
+    returns list of (path, format) of every PDF in <pdf_dir>/current_format and/or
+    <pdf_dir>/old_format
+    """
+    manuals = []
+    for manual_format in formats:
+        format_dir = os.path.join(pdf_dir, f'{manual_format}_format')
+        for file in sorted(os.listdir(format_dir)):
+            if file.lower().endswith('.pdf'):
+                manuals.append((os.path.join(format_dir, file), manual_format))
+
+    return manuals
+
+def benchmark_manual(pdf_fp, manual_format, text_source='ocr', stub_ocr=False,
+                     word_backend=DEFAULT_WORD_BACKEND):
+    """
+    takes str representing path to coding manual PDF and its format ('current' or 'old')
+    processes it from scratch (empty extraction cache) in a temporary working directory
+    returns dict of results: pages, seconds, pages/sec, peak memory, seconds per stage
+        and seconds stages overlapped (stage seconds beyond the manual's own seconds)
+        (meant to run in its own process, so peak memory is the manual's own)
+    """
+    pdf_fp = os.path.abspath(pdf_fp)
+    with pdfplumber.open(pdf_fp) as pdf:
+        num_pages = len(pdf.pages)
+
+    if stub_ocr:
+        import pytesseract
+        pytesseract.image_to_string = stub_image_to_string
+
+    timings = {}
+    time_stages(CURRENT_FORMAT_STAGES if manual_format == 'current' else OLD_FORMAT_STAGES, timings)
+
+    cwd = os.getcwd()
+    work_dir = tempfile.mkdtemp()
+    try:
+        os.chdir(work_dir) # cache, txts and xlsx go here
+        start = time.perf_counter()
+        with contextlib.redirect_stdout(open(os.devnull, 'w')):
+            match manual_format:
+                case 'current':
+                    from cmanual_pdf_to_data_dict import write_pdf_vars_to_xlsx
+                    write_pdf_vars_to_xlsx(pdf_fp, text_source=text_source,
+                                           word_backend=word_backend)
+                case 'old':
+                    from old_format_cmanual_pdf_to_data_dict import process_pdf
+                    process_pdf(pdf_fp, word_backend=word_backend)
+        seconds = time.perf_counter() - start
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    # stages running at the same time (see write_pdf_vars_to_xlsx) add up to more than the run
+    overlapped = max(sum(timings.values()) - seconds, 0.0)
+    timings['other'] = max(seconds - sum(timings.values()), 0.0)
+    return {'pdf': os.path.basename(pdf_fp),
+            'format': manual_format,
+            'pages': num_pages,
+            'seconds': round(seconds, 3),
+            'pages_per_sec': round(num_pages / seconds, 2),
+            'peak_rss_mb': get_peak_rss_mb(),
+            'overlapped_seconds': round(overlapped, 3),
+            'stages': {stage: round(stage_seconds, 3) for stage, stage_seconds in timings.items()}}
+
+def benchmark_corpus(pdf_dir='PDFs', formats=('current', 'old'), text_source='ocr',
+                     stub_ocr=False, word_backend=DEFAULT_WORD_BACKEND):
+    """
+    runs benchmark_manual on every PDF in <pdf_dir>/current_format and/or <pdf_dir>/old_format
+        each manual runs in a fresh process
+    prints a line per manual
+    returns dict of results (see benchmark_manual) with totals per format
+    """
+    manuals = []
+    for pdf_fp, manual_format in list_corpus(pdf_dir, formats):
+        # spawn (not fork) so nothing imported or patched here leaks into the run
+        with ProcessPoolExecutor(max_workers=1,
+                                 mp_context=multiprocessing.get_context('spawn')) as executor:
+            entry = executor.submit(benchmark_manual, pdf_fp, manual_format, text_source,
+                                    stub_ocr, word_backend).result()
+        manuals.append(entry)
+
+        stages = ', '.join(f'{stage} {stage_seconds:.2f}s'
+                           for stage, stage_seconds in entry['stages'].items())
+        if entry['overlapped_seconds']:
+            stages += f' ({entry['overlapped_seconds']:.2f}s overlapped)'
+        print(f'[{manual_format}] {entry['pdf']}: {entry['pages']} pages in {entry['seconds']:.2f}s '
+              f'({entry['pages_per_sec']} pages/s, peak {entry['peak_rss_mb']} MB) - {stages}')
+
+    totals = {}
+    for manual_format in formats:
+        entries = [entry for entry in manuals if entry['format'] == manual_format]
+        seconds = sum(entry['seconds'] for entry in entries)
+        pages = sum(entry['pages'] for entry in entries)
+        stages = {}
+        for entry in entries:
+            for stage, stage_seconds in entry['stages'].items():
+                stages[stage] = round(stages.get(stage, 0.0) + stage_seconds, 3)
+        totals[manual_format] = {'pages': pages,
+                                 'seconds': round(seconds, 3),
+                                 'pages_per_sec': round(pages / seconds, 2) if seconds else None,
+                                 'peak_rss_mb': max((entry['peak_rss_mb'] or 0 for entry in entries),
+                                                    default=None),
+                                 'stages': stages}
+        print(f'[{manual_format}] total: {pages} pages in {seconds:.2f}s '
+              f'({totals[manual_format]['pages_per_sec']} pages/s)')
+
+    return {'created': date_ext(full=True),
+            'text_source': text_source,
+            'stub_ocr': stub_ocr,
+            'word_backend': word_backend,
+            'manuals': manuals,
+            'totals': totals}
+
+def compare_to_baseline(results, baseline, threshold=0.2):
+    """
+    takes output of benchmark_corpus, a previous one (baseline) and allowed slowdown
+        (e.g. 0.2 = 20% slower/more memory)
+    returns list of str describing every regression
+        (manual time, stage time and peak memory of manuals in both runs are compared)
+    """
+    baseline_manuals = {(entry['format'], entry['pdf']): entry for entry in baseline['manuals']}
+
+    regressions = []
+    for entry in results['manuals']:
+        base = baseline_manuals.get((entry['format'], entry['pdf']))
+        if base is None:
+            continue
+
+        measures = [('seconds', entry['seconds'], base['seconds'])]
+        measures += [(f'{stage} seconds', stage_seconds, base['stages'].get(stage, 0.0))
+                     for stage, stage_seconds in entry['stages'].items()]
+        for measure, value, base_value in measures:
+            if max(value, base_value) < MIN_COMPARED_SECONDS:
+                continue
+            if value > base_value * (1 + threshold):
+                regressions.append(f'{entry['pdf']}: {measure} {base_value:.3f} -> {value:.3f}')
+
+        if entry['peak_rss_mb'] is not None and base['peak_rss_mb'] is not None:
+            if entry['peak_rss_mb'] > base['peak_rss_mb'] * (1 + threshold):
+                regressions.append(f'{entry['pdf']}: peak MB {base['peak_rss_mb']} -> '
+                                   f'{entry['peak_rss_mb']}')
+
+    return regressions
+
+def read_manual_words(pdf_fp, manual_format, word_backend):
+    """
+    takes str representing path to coding manual PDF, its format and a word backend
+    returns tuple
+        - seconds spent pulling words off pages
+        - words of every page (see word_backends.py)
+        - what the pipeline for manual_format makes of those words (nothing is cached)
+            - old: dict of variable name -> parsed description and coded values
+            - current: variable names on every page (by y) and number of observations
+    """
+    from extract_tables_and_var_names import get_varnames_on_page_by_ycoord, find_num_observations
+    from old_format_cmanual_pdf_to_data_dict import (extract_pdf_var_names, extract_var_text,
+                                                     parse_var_text)
+
+    with document_session(pdf_fp, word_backend) as session:
+        seconds = 0.0
+        words = []
+        for pg_num in range(session.num_pages):
+            start = time.perf_counter()
+            words.append(session.page_words(pg_num))
+            seconds += time.perf_counter() - start
+
+        match manual_format:
+            case 'old':
+                page_words_cache = {}
+                var_names = extract_pdf_var_names(session, page_words_cache)
+                name_to_text = extract_var_text(session, var_names, page_words_cache)
+                results = {name: parse_var_text(text) for name, text in name_to_text.items()}
+            case 'current':
+                results = ([get_varnames_on_page_by_ycoord(session, pg_num)
+                            for pg_num in range(session.num_pages)],
+                           find_num_observations(pdf_fp))
+
+    return seconds, words, results
+
+def count_same_words(page_words, other_page_words):
+    """
+    takes words of a page from two backends (see word_backends.py)
+    returns number of words both have, with the same text and box (in the same order)
+    """
+    texts = [word['text'] for word in page_words]
+    other_texts = [word['text'] for word in other_page_words]
+    matcher = difflib.SequenceMatcher(None, texts, other_texts, autojunk=False)
+
+    same = 0
+    for start, other_start, size in matcher.get_matching_blocks():
+        for word, other_word in zip(page_words[start:start+size],
+                                    other_page_words[other_start:other_start+size]):
+            same += all(abs(word[key] - other_word[key]) <= WORD_BOX_TOLERANCE
+                        for key in ('x0', 'x1', 'top', 'bottom'))
+
+    return same
+
+def is_same_pipeline_result(manual_format, result, other_result):
+    """
+    takes format and two outputs of read_manual_words (its last item)
+    returns whether the pipeline made the same of both backends' words
+        (name positions of current format manuals may differ by WORD_BOX_TOLERANCE)
+    """
+    if manual_format == 'old':
+        return result == other_result
+
+    names_by_page, num_observations = result
+    other_names_by_page, other_num_observations = other_result
+    for names, other_names in zip(names_by_page, other_names_by_page):
+        if list(names.values()) != list(other_names.values()):
+            return False
+        if any(abs(y - other_y) > WORD_BOX_TOLERANCE for y, other_y in zip(names, other_names)):
+            return False
+
+    return num_observations == other_num_observations
+
+def benchmark_word_backends(pdf_dir='PDFs', formats=('current', 'old'),
+                            word_backends=tuple(WORD_BACKENDS)):
+    """
+    pulls the words off every page of every bundled PDF with each word backend
+    prints a line per manual: seconds and pages/sec per backend, share of words identical
+    (text and box) to the first backend's, and whether the pipeline results are the same
+    returns list of str naming every manual the pipeline results differ for
+    """
+    reference_backend = word_backends[0]
+    totals = {word_backend: [0, 0.0] for word_backend in word_backends} # pages, seconds
+    mismatches = []
+    num_words = num_same_words = 0
+    for pdf_fp, manual_format in list_corpus(pdf_dir, formats):
+        runs = {word_backend: read_manual_words(pdf_fp, manual_format, word_backend)
+                for word_backend in word_backends}
+        _, reference_words, reference_results = runs[reference_backend]
+        num_pages = len(reference_words)
+
+        timings = []
+        parities = []
+        for word_backend, (seconds, words, results) in runs.items():
+            totals[word_backend][0] += num_pages
+            totals[word_backend][1] += seconds
+            timings.append(f'{word_backend} {seconds:.2f}s ({num_pages / seconds:.0f} pages/s)')
+            if word_backend == reference_backend:
+                continue
+
+            paired_pages = list(zip(reference_words, words))
+            same_words = sum(count_same_words(page_words, other_page_words)
+                             for page_words, other_page_words in paired_pages)
+            manual_words = sum(len(page_words) for page_words, _ in paired_pages)
+            num_words += manual_words
+            num_same_words += same_words
+            same_results = is_same_pipeline_result(manual_format, reference_results, results)
+            if not same_results:
+                mismatches.append(f'{os.path.basename(pdf_fp)} ({word_backend})')
+            parities.append(f'{word_backend} words {100 * same_words / max(manual_words, 1):.1f}% '
+                            f'same, results {'same' if same_results else 'DIFFERENT'}')
+
+        print(f'[{manual_format}] {os.path.basename(pdf_fp)}: {num_pages} pages - '
+              f'{', '.join(timings)} - {', '.join(parities)}')
+
+    for word_backend, (pages, seconds) in totals.items():
+        print(f'{word_backend}: {pages} pages in {seconds:.2f}s ({pages / seconds:.1f} pages/s)')
+    if len(word_backends) > 1:
+        print(f'{100 * num_same_words / max(num_words, 1):.2f}% of words same as {reference_backend}')
+
+    return mismatches
+
+def time_import(module_name):
+    """
+    takes name of module to import
+    imports it in a fresh interpreter (run from this directory)
+    returns tuple (seconds the import took, list of STARTUP_REPORTED_MODULES it loaded)
+    """
+    code = (f'import importlib, json, sys, time\n'
+            f'start = time.perf_counter()\n'
+            f'importlib.import_module({module_name!r})\n'
+            f'print(json.dumps([time.perf_counter() - start,\n'
+            f'                  [m for m in {STARTUP_REPORTED_MODULES!r} if m in sys.modules]]))')
+    completed = subprocess.run([sys.executable, '-c', code], capture_output=True, text=True,
+                               check=True, cwd=os.path.dirname(os.path.abspath(__file__)))
+    seconds, loaded = json.loads(completed.stdout.strip().splitlines()[-1])
+
+    return seconds, loaded
+
+def benchmark_startup(repeats=5):
+    """
+    times importing every entry point in STARTUP_ENTRY_POINTS (median of repeats, each in a
+    fresh interpreter) and checks it does not load the modules it is not supposed to
+    prints a line per entry point
+    returns list of str describing every entry point that loads a module it should not
+    """
+    failures = []
+    for module_name, unwanted in STARTUP_ENTRY_POINTS.items():
+        runs = [time_import(module_name) for _ in range(repeats)]
+        seconds = sorted(run_seconds for run_seconds, _ in runs)[len(runs) // 2]
+        loaded = runs[0][1]
+        print(f'{module_name}: {seconds:.3f}s (loads {', '.join(loaded) or 'none'} '
+              f'of {', '.join(STARTUP_REPORTED_MODULES)})')
+
+        if unexpected := [module for module in unwanted if module in loaded]:
+            failures.append(f'{module_name} loads {', '.join(unexpected)} at import')
+
+    return failures
+
+def main():
+    """
+    command line entry point, see --help
+    """
+    parser = argparse.ArgumentParser(description='Coding manual pipeline benchmarks.')
+    subparsers = parser.add_subparsers(dest='benchmark', required=True)
+
+    xlsx_parser = subparsers.add_parser('xlsx', help='scaling of write_variables_to_xlsx')
+    xlsx_parser.add_argument('--sizes', type=int, nargs='+', default=[500, 1000, 2000, 4000, 8000],
+                             help='numbers of variables to write')
+
+    corpus_parser = subparsers.add_parser('corpus', help='both pipelines over the bundled PDFs')
+    corpus_parser.add_argument('--pdf-dir', default='PDFs',
+                               help='directory with current_format/ and old_format/ PDFs')
+    corpus_parser.add_argument('--formats', nargs='+', default=['current', 'old'],
+                               choices=['current', 'old'], help='corpora to run')
+    corpus_parser.add_argument('--text-source', default='ocr', choices=['ocr', 'hybrid', 'regions'],
+                               help='description text source for current format manuals')
+    corpus_parser.add_argument('--stub-ocr', action='store_true',
+                               help='replace Tesseract with a stub that reads no text')
+    corpus_parser.add_argument('--word-backend', default=DEFAULT_WORD_BACKEND,
+                               choices=list(WORD_BACKENDS), help='how words are pulled from pages')
+    corpus_parser.add_argument('--output', default=None,
+                               help='path of json results (default: output/benchmarks/corpus_<time>.json)')
+    corpus_parser.add_argument('--baseline', default=None,
+                               help='json results of a previous run to check for regressions')
+    corpus_parser.add_argument('--threshold', type=float, default=0.2,
+                               help='allowed slowdown over baseline (default: 0.2 = 20%%)')
+    corpus_parser.add_argument('--update-baseline', action='store_true',
+                               help='save results as the new baseline (--baseline path)')
+
+    words_parser = subparsers.add_parser('words', help='word backend throughput and parity')
+    words_parser.add_argument('--pdf-dir', default='PDFs',
+                              help='directory with current_format/ and old_format/ PDFs')
+    words_parser.add_argument('--formats', nargs='+', default=['current', 'old'],
+                              choices=['current', 'old'], help='corpora to run')
+    words_parser.add_argument('--word-backends', nargs='+', default=list(WORD_BACKENDS),
+                              choices=list(WORD_BACKENDS),
+                              help='backends to compare (first is the reference for parity)')
+
+    startup_parser = subparsers.add_parser('startup', help='import time of every entry point')
+    startup_parser.add_argument('--repeats', type=int, default=5,
+                                help='imports timed per entry point (median is reported)')
+
+    args = parser.parse_args()
+    match args.benchmark:
+        case 'xlsx':
+            benchmark_xlsx_writer(args.sizes)
+        case 'words':
+            mismatches = benchmark_word_backends(args.pdf_dir, args.formats, args.word_backends)
+            for mismatch in mismatches:
+                print(f'PARITY FAILED {mismatch}: pipeline results differ')
+            return 1 if mismatches else 0
+        case 'startup':
+            failures = benchmark_startup(args.repeats)
+            for failure in failures:
+                print(f'FAILED {failure}')
+            return 1 if failures else 0
+        case 'corpus':
+            results = benchmark_corpus(args.pdf_dir, args.formats, args.text_source, args.stub_ocr,
+                                       args.word_backend)
+
+            output_fp = args.output or os.path.join('output', 'benchmarks',
+                                                    f'corpus_{date_ext(full=True)}.json')
+            make_dir(os.path.dirname(output_fp))
+            with open(output_fp, 'w', encoding='utf-8') as f:
+                json.dump(results, f, indent=2)
+            print(f'Results written to {output_fp}')
+
+            if args.baseline is None:
+                return 0
+            if args.update_baseline or not os.path.isfile(args.baseline):
+                shutil.copyfile(output_fp, args.baseline)
+                print(f'Baseline saved to {args.baseline}')
+                return 0
+
+            with open(args.baseline, encoding='utf-8') as f:
+                baseline = json.load(f)
+            regressions = compare_to_baseline(results, baseline, args.threshold)
+            for regression in regressions:
+                print(f'REGRESSION {regression}')
+            print(f'{len(regressions)} regressions over {args.threshold:.0%} vs {args.baseline}')
+            return 1 if regressions else 0
+
+    return 0
+
+if __name__ == '__main__':
+    raise SystemExit(main())
@@ -4,298 +4,701 @@ script to read coding manual PDFs, parse info, and create xlsx summary
 NOTE: intended for coding manuals in the currently used format
 """
 
+import itertools
 import os
 import re
-from collections import defaultdict
-import cv2
-import pytesseract
-import pandas as pd
+import time
+from contextlib import nullcontext
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 import pymupdf
-from fhs_utility.misc import make_dir, date_ext
-from extract_tables_and_var_names import map_var_to_table, get_num_observations
-
-# make sure path points to tesseract.exe file
-pytesseract.pytesseract.tesseract_cmd = r'C:/Program Files/Tesseract-OCR/tesseract.exe'
-
-class Variable:
-    """
-    Class to represent a variable parsed from pdf
-    Fields:
-        - name: str
-        - description: str
-        - values: dict (optional, None if not defined)
-            - keys: different values Variable can take on
-            - values:
-                - 'Description': description of what value means (str)
-                - 'Count': count of data that has that value (int) (optional, None if not defined)
-        - pdf_fp: str
-            - file path to pdf variable is in
-    """
-    def __init__(self, name, description, values, total_obv):
-        self.name = name
-        self.description = description
-        self.values = values
-        self.total_obv = total_obv
-
-    def __str__(self):
-        values_rep = [(val, val_info) for val, val_info in self.values.items()] \
-                     if self.values is not None else None
-        return f'name: {self.name}\ndescription: {self.description}\nvalues: {values_rep}'
-
-    def to_dataframe(self):
-        """
-        converts variable to pandas dataframe for writing to xlsx
-        """
-        col_names = ['Variable', 'Description', 'N', 'Miss',
-                     'Minimum', 'Maximum', 'Units', 'Coded Values', 'Variable Notes']
-
-        # N + Miss
-        total = self.total_obv
-        count = 0
-        if self.values is not None and total is not None:
-            for val, val_info in self.values.items():
-                if val_info['Count'] is None:
-                    break
-                else:
-                    count += int(val_info['Count'])
+from fhs_utility.misc import make_dir
+from extract_tables_and_var_names import (map_var_to_table, get_num_observations,
+                                          get_all_tables_and_names_by_page_by_ycoord,
+                                          estimate_skipped_table_seconds)
+from document_session import WORKER_MP_CONTEXT, document_session, open_worker_session
+from extraction_cache import iter_cached_pages
+from instrumentation import span, count, get_peak_rss_mb
+from output_writers import check_output_formats, write_variables
+from page_budgets import DEFAULT_PAGE_SECONDS, Budget, BudgetExceeded, run_within_budget
+from word_backends import DEFAULT_WORD_BACKEND
+from variable import Variable # re-exported, still importable from here
 
-        match count:
-            case 0:
-                count = ''
+# make sure path points to tesseract.exe file (if it does not exist, tesseract on PATH is used)
+TESSERACT_CMD = r'C:/Program Files/Tesseract-OCR/tesseract.exe'
 
-        if total is not None and count != '':
-            misses = total - count
-        else:
-            misses = ''
-
-        # Minimum + Maximum
-        match self.values:
-            case None:
-                maximum = ''
-                minimum = ''
-            case _:
-                codes = []
-                for code in self.values.keys():
-                    if '–' in code or '—' in code or '-' in code:
-                        code = code.replace('–', '-')
-                        code = code.replace('—', '-')
-                        code = re.sub(r'\s', '', code)
-                        for x in code.split('-'):
-                            try:
-                                float(x)
-                            except:
-                                continue
-                            else:
-                                codes.append(float(x))
-                    else:
-                        try:
-                            float(code)
-                        except:
-                            continue
-                        else:
-                            codes.append(float(code))
-                if len(codes) != 0:
-                    maximum = max(codes)
-                    minimum = min(codes)
-                else:
-                    maximum = ''
-                    minimum = ''
-
-        # Coded Values
-        values_rep = ''
-        match self.values:
-            case None:
-                pass
-            case _:
-                for val, val_info in self.values.items():
-                    s = f'{val} = {val_info['Description']}\r\n'
-                    values_rep += s
-        values_rep = values_rep.rstrip()
-
-        # Variable Notes
-        var_notes = ''
-        if 'Note:' in self.description:
-            var_notes += self.description.split('Note:')[1].strip()
-            self.description = self.description.split('Note:')[0].strip()
-
-        # Units
-        units = ''
-        if 'Units:' in self.description:
-            units += self.description.split('Units:')[1].strip()
-            self.description = self.description.split('Units:')[0].strip()
-
-        d = [{'Variable': self.name,
-            'Description': self.description,
-            'N': count,
-            'Miss': misses,
-            'Minimum': minimum,
-            'Maximum': maximum,
-            'Units': units,
-            'Coded Values': values_rep,
-            'Variable Notes': var_notes}]
-
-        return pd.DataFrame(d, columns=col_names, index=range(len(d)))
-
-def convert_pdf_to_images(pdf_fp):
+PAGE_BREAK = '!!!PAGEBREAK!!!\n'
+
+# ends each region's text in region ocr, all caps line so it also ends the description
+REGION_BREAK = '!!!REGIONBREAK!!!\n'
+
+# points kept between a description region and the header/table that bounds it
+REGION_MARGIN = 2
+
+# starts text of a page (region) whose ocr went over budget (see ocr_session_page),
+# all caps line so it also ends the description
+DEGRADED_PAGE = '!!!DEGRADEDPAGE!!!\n'
+
+OCR_DPI = 300
+LOW_OCR_DPI = 150 # cheaper retry of pages that go over budget
+
+def convert_pdf_to_images(pdf_fp, page_nums=None):
     """
     takes in a string representing the path to a PDF
     converts each page of pdf to png image in created directories
+        if page_nums (list of page numbers) is given, only those pages are converted
+    returns list of paths of the images, in order of page_nums (page order if not given)
     """
     pdf_image_dir = 'pdf_to_image'
     filename = os.path.basename(pdf_fp).replace('.pdf', '')
     output_dir = os.path.join(pdf_image_dir, filename)
     make_dir(output_dir)
 
-    document = pymupdf.open(pdf_fp)
-    for page_num in range(len(document)):
-        page = document.load_page(page_num)
-        pix = page.get_pixmap(dpi=300)
-        out_fp = os.path.join(output_dir, f'page_{str(page_num).zfill(4)}.png')
-        pix.save(out_fp)
+    image_fps = []
+    with document_session(pdf_fp) as session:
+        if page_nums is None:
+            page_nums = range(session.num_pages)
+        for page_num in page_nums:
+            page = session.document.load_page(page_num)
+            pix = page.get_pixmap(dpi=300)
+            out_fp = os.path.join(output_dir, f'page_{str(page_num).zfill(4)}.png')
+            pix.save(out_fp)
+            image_fps.append(out_fp)
 
-    return output_dir
+    return image_fps
 
-def read_pdf_text_ocr(pdf_fp, regen_text=False):
+def get_pytesseract():
     """
-    reads png images made by convert_pdf_to_images
-    uses pytesseract to invoke tesseract ocr
-    concatenates text from images into String
-    writes to new txt file
+    returns pytesseract module, imported on first use so only ocr pays for it
+    (points it at TESSERACT_CMD when that exists)
     """
-    pdf_image_dir = 'pdf_to_image'
-    filename = os.path.basename(pdf_fp).replace('.pdf', '')
-    images_dir = os.path.join(pdf_image_dir, filename)
-    if not os.path.isdir(images_dir):
-        convert_pdf_to_images(pdf_fp)
-
-    txt_output = 'PDF_txts'
-    make_dir(txt_output)
-    filename = os.path.join(txt_output, f'{filename}.txt')
-    if os.path.isfile(filename) and not regen_text:
-        with open(filename, 'r', encoding='utf-8') as f:
-            text =  f.read()
-            return text
-
-    page_images = os.listdir(images_dir)
-
-    text = ''
-    i=1
-    for page in page_images:
-        _, ext = os.path.splitext(page)
-        if ext.lower() != '.png':
-            continue
+    import pytesseract
+    if os.path.isfile(TESSERACT_CMD):
+        pytesseract.pytesseract.tesseract_cmd = TESSERACT_CMD
+    return pytesseract
 
-        print(f'reading page {i}...')
-        i+=1
-
-        image = cv2.imread(os.path.join(images_dir, page))
-
-        gray_image = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+def ocr_image(gray_image, seconds=None):
+    """
+    takes grayscale page image (numpy array) (and seconds tesseract may take, None = no limit)
+    binarizes (otsu) and boosts contrast, then invokes tesseract ocr
+    returns text of image
+    raises page_budgets.BudgetExceeded if tesseract takes longer (it is killed)
+    """
+    import cv2 # ocr only, see get_pytesseract
+    pytesseract = get_pytesseract()
 
+    with span('preprocess'):
         _, binary_image = cv2.threshold(gray_image, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
 
         enhanced_image = cv2.convertScaleAbs(binary_image, alpha=1.5, beta=0)
 
-        page_text = pytesseract.image_to_string(enhanced_image)
-        text += page_text
-        text += '!!!PAGEBREAK!!!\n'
+    with span('ocr'):
+        try:
+            return pytesseract.image_to_string(enhanced_image, timeout=seconds or 0)
+        except RuntimeError as e:
+            if 'timeout' in str(e):
+                raise BudgetExceeded
+            raise
 
-    with open(filename, 'w', encoding='utf-8') as f:
-        f.write(text)
+def ocr_page_image(image_fp):
+    """
+    takes str representing path to png image of a page (made by convert_pdf_to_images)
+    returns ocr text of page
+    (module level so it can be sent to worker processes)
+    """
+    import cv2 # ocr only, see get_pytesseract
 
-    return text
+    with span('ocr page', image=os.path.basename(image_fp)):
+        with span('read image'):
+            image = cv2.imread(image_fp)
 
-def remove_page_numbers(text):
+            gray_image = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+
+        count('pages ocrd')
+        return ocr_image(gray_image)
+
+def ocr_document_page(document, page_num, dpi=OCR_DPI, clip=None, seconds=None):
     """
-    uses regex to remove page numbers from inputted String
+    takes pymupdf document object and int (falling in range(<number of pages in pdf>))
+    renders page straight to a grayscale pixmap and ocrs it (no png written)
+        clip: optional (x0, top, x1, bottom), only that region of the page is rendered
+    returns ocr text of page (region)
+    raises page_budgets.BudgetExceeded if it takes more than seconds (None = no limit)
     """
-    pattern = r'Page \d+ of \d+'
-    return re.sub(pattern, '', text)
-
-def get_descriptions(text):
+    import numpy as np # ocr only, see get_pytesseract
+
+    start = time.perf_counter()
+    with span('ocr page' if clip is None else 'ocr region', page=page_num):
+        with span('render'):
+            page = document.load_page(page_num)
+            pix = page.get_pixmap(dpi=dpi, colorspace=pymupdf.csGRAY,
+                                  clip=pymupdf.Rect(clip) if clip is not None else None)
+
+        # view over the pixmap's own memory (no copy), pix has to stay alive until ocr is done
+        gray_image = np.frombuffer(pix.samples_mv, dtype=np.uint8).reshape(pix.height, pix.width)
+
+        count('pages ocrd' if clip is None else 'regions ocrd')
+        if seconds is not None:
+            # rendering cannot be interrupted, tesseract gets what is left
+            seconds -= time.perf_counter() - start
+            if seconds <= 0:
+                raise BudgetExceeded
+        return ocr_image(gray_image, seconds=seconds)
+
+def ocr_session_page(session, page_num, clip=None):
     """
-    pulls text from after appearances of "Description:" in text
-        reads line by line until text of line indicates description has concluded 
-    (assuming for now that description is not split over a pagebreak)
+    takes document session (see document_session.py), page number (and optional clip region)
+    returns ocr text of page (region) (see ocr_document_page), read within the page budget
+        over budget, it is read again at LOW_OCR_DPI, then given up on ('')
+        text of a page that went over budget starts with DEGRADED_PAGE
+    """
+    text, degraded = run_within_budget(session.budget, [
+        (f'ocr at {OCR_DPI} dpi',
+         lambda seconds: ocr_document_page(session.document, page_num, clip=clip, seconds=seconds)),
+        (f'ocr at {LOW_OCR_DPI} dpi',
+         lambda seconds: ocr_document_page(session.document, page_num, dpi=LOW_OCR_DPI, clip=clip,
+                                           seconds=seconds)),
+    ], fallback='')
+    if degraded is None:
+        return text
+    session.degrade(page_num, degraded)
+    return f'{DEGRADED_PAGE}{text}'
+
+def ocr_pdf_page(pdf_fp, page_num, clip=None):
+    """
+    takes str representing path to PDF and page number (and optional clip region)
+    returns ocr text of that page (see ocr_session_page)
+    (module level so it can be sent to worker processes, see open_worker_session)
     """
-    desc_texts = text.split('Description:')[1:]
+    with document_session(pdf_fp) as session:
+        return ocr_session_page(session, page_num, clip=clip)
 
-    descriptions = []
-    for desc_text in desc_texts:
-        desc_text = remove_page_numbers(desc_text)
-        lines = desc_text.split('\n')
-        desc = ''
-        for line in lines:
-            line = line.strip()
+def ocr_pdf_page_regions(pdf_fp, page_num, clips):
+    """
+    takes str representing path to PDF, page number and list of clip regions on that page
+    returns list of ocr text of each region (see ocr_session_page)
+    (module level so it can be sent to worker processes, see open_worker_session)
+    """
+    with document_session(pdf_fp) as session:
+        return [ocr_session_page(session, page_num, clip=clip) for clip in clips]
 
-            if ('Description' in line or 'Code or Value' in line or
-            (re.search('[A-Z]', line) is not None and line.upper() == line and ' ' not in line)):
-                break
+def iter_ocr_pages(pdf_fp, workers=1, cache_images=False, page_nums=None):
+    """
+    generator, renders each page of PDF to an in-memory grayscale image and ocrs it
+    yields text of each page in page order, as soon as it is read
+        if page_nums (list of page numbers) is given, only those pages are read
+        if workers > 1, pages are spread across that many worker processes
+        if cache_images, pages go through png images made by convert_pdf_to_images
+        instead (kept in pdf_to_image/ for debugging)
+    """
+    if cache_images:
+        image_fps = convert_pdf_to_images(pdf_fp, page_nums=page_nums)
 
-            desc_line = re.sub(r' {2,}', ' ', line.strip())
-            desc += f'{desc_line} '
-        if desc.strip() == '' or desc.lower().strip() == 'units:':
-            descriptions.append('!MANUALLY INPUT DESCRIPTION!')
+        if workers > 1:
+            print(f'reading {len(image_fps)} pages across {workers} processes...')
+            with ProcessPoolExecutor(max_workers=workers, mp_context=WORKER_MP_CONTEXT) as executor:
+                yield from executor.map(ocr_page_image, image_fps)
         else:
-            descriptions.append(desc.strip())
-    return descriptions
+            for image_fp in image_fps:
+                print(f'reading {os.path.basename(image_fp)}...')
+                yield ocr_page_image(image_fp)
+    else:
+        with document_session(pdf_fp) as session:
+            if page_nums is None:
+                page_nums = range(session.num_pages)
+            if workers > 1:
+                print(f'reading {len(page_nums)} pages across {workers} processes...')
+                with ProcessPoolExecutor(max_workers=workers, mp_context=WORKER_MP_CONTEXT,
+                                         initializer=open_worker_session,
+                                         initargs=(pdf_fp, session.word_backend,
+                                                   session.budget)) as executor:
+                    yield from executor.map(ocr_pdf_page, [pdf_fp]*len(page_nums), page_nums)
+            else:
+                for page_num in page_nums:
+                    print(f'reading page {page_num+1}...')
+                    yield ocr_session_page(session, page_num)
+
+def read_page_text_layer(page):
+    """
+    takes pymupdf page object
+    pulls text from the page's native (embedded) text layer
+    outputs list of str, one per line of text (top to bottom, left to right)
+        - text covered by a filled shape drawn after it (e.g. bookmark labels hidden under
+          the gray variable header bars) is skipped, ocr does not see it either
+        - white and fully transparent text is skipped for the same reason
+    """
+    fills = [(drawing['seqno'], drawing['rect']) for drawing in page.get_drawings()
+             if drawing['fill'] is not None and drawing['rect'].height > 5]
 
-def write_variables_to_xlsx(fp, variables):
+    spans = []
+    for trace_span in page.get_texttrace():
+        if (not trace_span['chars'] or trace_span['opacity'] == 0 or
+            trace_span['color'] == (1.0, 1.0, 1.0)):
+            continue
+        bbox = pymupdf.Rect(trace_span['bbox'])
+        if any(seqno > trace_span['seqno'] and rect.contains(bbox) for seqno, rect in fills):
+            continue
+        baseline = trace_span['chars'][0][2][1]
+        text = ''.join(chr(char[0]) for char in trace_span['chars'])
+        spans.append((baseline, bbox.x0, bbox.x1, text))
+
+    # spans with (nearly) the same baseline make up a line
+    lines = []
+    spans.sort()
+    for baseline, x0, x1, text in spans:
+        if lines and abs(lines[-1][0] - baseline) <= 2:
+            lines[-1][1].append((x0, x1, text))
+        else:
+            lines.append((baseline, [(x0, x1, text)]))
+
+    text_lines = []
+    for _, line_spans in lines:
+        line_spans.sort()
+        line = ''
+        last_x1 = None
+        for x0, x1, text in line_spans:
+            if last_x1 is not None and x0 - last_x1 > 1:
+                line += ' '
+            line += text
+            last_x1 = x1
+        text_lines.append(line.strip())
+
+    return text_lines
+
+def is_text_layer_usable(text_lines, min_chars=20):
     """
-    takes in str representing fp and list of variables objects
-    concatonates variable DataFrames into one DataFrame
-    writes df to xlsx in created directories
+    takes output of read_page_text_layer
+    checks whether page has enough real text to skip ocr
+        (image-only/scanned pages have no text or text without unicode mappings)
     """
-    output_dir = os.path.join('output', date_ext())
-    make_dir(output_dir)
-    fp_out = f"Data_Dictionary_{os.path.split(fp)[-1].replace('.pdf', '')}.xlsx"
-    fp_out = os.path.join(output_dir, fp_out)
-    with pd.ExcelWriter(fp_out) as writer:
-        writer.book.formats[0].set_text_wrap()
-        df = pd.DataFrame(columns=['Variable', 'Description', 'N', 'Miss',
-                                   'Minimum', 'Maximum', 'Units', 'Coded Values', 'Variable Notes'])
-        for var in variables:
-            df = pd.concat([df, var.to_dataframe()])
+    text = re.sub(r'\s', '', ''.join(text_lines))
+    if len(text) < min_chars:
+        return False
+    return text.count('\ufffd') / len(text) < 0.1
 
-        df.to_excel(writer, sheet_name='Data Dictionary', index=False)
+def iter_hybrid_pages(pdf_fp, workers=1, page_nums=None):
+    """
+    generator, takes str representing path to PDF
+    uses the PDF's native text layer for pages that have a usable one
+    rasterizes + ocrs (see ocr_document_page) only pages that do not (scanned/image-only)
+        if workers > 1, those pages are spread across that many worker processes
+    yields text of each page in page order
+        if page_nums (list of page numbers) is given, only those pages are read
+    """
+    with document_session(pdf_fp) as session:
+        document = session.document
+        if page_nums is None:
+            page_nums = range(len(document))
+        layer_texts = {}
+        for page_num in page_nums:
+            with span('text layer', page=page_num):
+                text_lines = read_page_text_layer(document.load_page(page_num))
+            if is_text_layer_usable(text_lines):
+                layer_texts[page_num] = '\n'.join(text_lines) + '\n'
+        ocr_page_nums = [page_num for page_num in page_nums if page_num not in layer_texts]
+
+        print(f'{len(layer_texts)} pages read from text layer, {len(ocr_page_nums)} need ocr...')
+        with (ProcessPoolExecutor(max_workers=workers, mp_context=WORKER_MP_CONTEXT,
+                                  initializer=open_worker_session,
+                                  initargs=(pdf_fp, session.word_backend, session.budget))
+              if workers > 1 else nullcontext()) as executor:
+            if executor is not None:
+                ocr_texts = executor.map(ocr_pdf_page, [pdf_fp]*len(ocr_page_nums), ocr_page_nums)
+            else:
+                ocr_texts = (ocr_session_page(session, page_num) for page_num in ocr_page_nums)
+
+            # ocr_texts come in order of ocr_page_nums, i.e. page order
+            for page_num in page_nums:
+                if page_num in layer_texts:
+                    yield layer_texts.pop(page_num)
+                else:
+                    print(f'reading page {page_num+1}...')
+                    yield next(ocr_texts)
 
-def write_pdf_vars_to_xlsx(pdf_fp, regen_text=False):
+def get_description_regions(pdf_fp, workers=1, tables_and_names=None):
     """
-    takes str representing reletive path to coding manual PDF
-    writes xlsx data dictionary using above methods
+    takes str representing path to PDF
+    uses variable name and table coordinates found by pdfplumber
+        (see get_all_tables_and_names_by_page_by_ycoord)
+        tables_and_names: its output, if already found (read only)
+    outputs dict
+        - keys: integers in range(<number of pages in pdf>)
+        - values: list of regions (x0, top, x1, bottom) on that page, top to bottom
+            each from a "Variable name:" header down to the next table, next header
+            or bottom of page (whichever comes first), i.e. the text its description is in
+            if the last region of the previous page ran to the bottom of that page,
+            the top of the page down to the first table/header is a region too
+            (header at bottom of page, description at top of next)
+    """
+    if tables_and_names is None:
+        tables_and_names = get_all_tables_and_names_by_page_by_ycoord(pdf_fp, workers=workers)
+    vars_by_pg_num, tables_by_pg_num = tables_and_names
+    regions_by_pg_num = {}
+    continued = False
+    with document_session(pdf_fp) as session:
+        for pg_num in range(session.num_pages):
+            page_rect = session.page_rect(pg_num)
+            name_ys = sorted(vars_by_pg_num.get(pg_num, {}))
+            table_tops = [table_info['raw_table'].bbox[1]
+                          for table_info in tables_by_pg_num.get(pg_num, {}).values()]
+
+            tops = [page_rect.y0] if continued else []
+            tops += [max(name_y - REGION_MARGIN, page_rect.y0) for name_y in name_ys]
+
+            regions = []
+            continued = False
+            for top in tops:
+                bottom = min([y - REGION_MARGIN for y in name_ys + table_tops
+                              if y - REGION_MARGIN > top], default=page_rect.y1)
+                continued = bottom == page_rect.y1
+                regions.append((page_rect.x0, top, page_rect.x1, bottom))
+            regions_by_pg_num[pg_num] = regions
+
+    return regions_by_pg_num
+
+def iter_region_pages(pdf_fp, workers=1, page_nums=None, regions_by_pg_num=None):
+    """
+    generator, takes str representing path to PDF
+    renders + ocrs only the description regions of each page (see get_description_regions),
+        headers, tables and boilerplate around them are never rasterized
+        if workers > 1, pages are spread across that many worker processes
+    yields text of each page in page order, regions delimited by REGION_BREAK
+        (pages without variables yield '')
+        if page_nums (list of page numbers) is given, only those pages are read
+    regions_by_pg_num: output of get_description_regions, if already found
     """
-    print(f'Reading PDF... ({':'.join(date_ext(full=True).split('_')[1:])})')
-    pdf_text = read_pdf_text_ocr(pdf_fp, regen_text=regen_text)
+    if regions_by_pg_num is None:
+        regions_by_pg_num = get_description_regions(pdf_fp, workers=workers)
+    if page_nums is None:
+        page_nums = range(len(regions_by_pg_num))
+    clips = [clip for pg_num in page_nums for clip in regions_by_pg_num[pg_num]]
+
+    with document_session(pdf_fp) as session:
+        page_area = sum(session.page_rect(pg_num).get_area() for pg_num in page_nums)
+        region_area = sum((x1 - x0) * (bottom - top) for x0, top, x1, bottom in clips)
+        print(f'reading {len(clips)} description regions '
+              f'({100*region_area/max(page_area, 1):.1f}% of page area)...')
+
+        with (ProcessPoolExecutor(max_workers=workers, mp_context=WORKER_MP_CONTEXT,
+                                  initializer=open_worker_session,
+                                  initargs=(pdf_fp, session.word_backend, session.budget))
+              if workers > 1 else nullcontext()) as executor:
+            if executor is not None:
+                page_region_texts = executor.map(ocr_pdf_page_regions, [pdf_fp]*len(page_nums),
+                                                 page_nums,
+                                                 [regions_by_pg_num[pg_num] for pg_num in page_nums])
+            else:
+                page_region_texts = ([ocr_session_page(session, pg_num, clip=clip)
+                                      for clip in regions_by_pg_num[pg_num]] for pg_num in page_nums)
+
+            for region_texts in page_region_texts:
+                yield ''.join(f'{region_text}{REGION_BREAK}' for region_text in region_texts)
+
+def iter_pdf_page_texts(pdf_fp, text_source='ocr', regen_text=False, workers=1,
+                        cache_images=False, regions_by_pg_num=None):
+    """
+    generator, yields text of each page of PDF in page order, as soon as it is read
+    text_source:
+        - 'ocr': ocr every page (see iter_ocr_pages)
+        - 'hybrid': native text layer, ocr only pages without one (see iter_hybrid_pages)
+        - 'regions': ocr only the description regions of each page (see iter_region_pages)
+            regions_by_pg_num: output of get_description_regions, if already found
+    text of each page is stored in extraction cache, only pages that were not read before
+        (in this or a previous version of the PDF) are read (unless regen_text)
+        (see iter_cached_pages), except pages that went over budget (see ocr_session_page)
+    writes text to new txt file as pages come in (pages delimited by PAGE_BREAK),
+        only one page of text is held in memory at a time
+    """
+    stage = f'page_{text_source}_text'
+    page_variants = None
+    match text_source:
+        case 'ocr':
+            read_pages = lambda page_nums: iter_ocr_pages(pdf_fp, workers=workers,
+                                                          cache_images=cache_images,
+                                                          page_nums=page_nums)
+        case 'hybrid':
+            read_pages = lambda page_nums: iter_hybrid_pages(pdf_fp, workers=workers,
+                                                             page_nums=page_nums)
+        case 'regions':
+            # a page's text also depends on which regions of it are read
+            if regions_by_pg_num is None:
+                regions_by_pg_num = get_description_regions(pdf_fp, workers=workers)
+            page_variants = [regions_by_pg_num[pg_num] for pg_num in range(len(regions_by_pg_num))]
+            read_pages = lambda page_nums: iter_region_pages(pdf_fp, workers=workers,
+                                                             page_nums=page_nums,
+                                                             regions_by_pg_num=regions_by_pg_num)
+        case _:
+            raise ValueError(f'unknown text_source: {text_source}')
+    pages = iter_cached_pages(pdf_fp, stage, read_pages, page_variants=page_variants,
+                              regen=regen_text, keep=lambda page_text: DEGRADED_PAGE not in page_text)
 
-    print(f'Collecting descriptions... ({':'.join(date_ext(full=True).split('_')[1:])})')
-    descriptions = get_descriptions(pdf_text)
+    txt_output = 'PDF_txts'
+    make_dir(txt_output)
+    filename = os.path.basename(pdf_fp).replace('.pdf', '')
+    suffix = '' if text_source == 'ocr' else f'_{text_source}'
+    txt_fp = os.path.join(txt_output, f'{filename}{suffix}.txt')
 
-    print(f'Collecting names and tables... ({':'.join(date_ext(full=True).split('_')[1:])})')
-    name_to_table = map_var_to_table(pdf_fp)
-    names = list(name_to_table.keys())
-    names.sort(key=lambda name: name_to_table[name]['location'])
+    # txt only replaces the previous one once complete
+    with open(f'{txt_fp}.tmp', 'w', encoding='utf-8') as f:
+        for page_text in pages:
+            f.write(f'{page_text}{PAGE_BREAK}')
+            yield page_text
+    os.replace(f'{txt_fp}.tmp', txt_fp)
 
-    print(f'Creating variable objects... ({':'.join(date_ext(full=True).split('_')[1:])})')
-    total = get_num_observations(pdf_fp)
-    variable_dict = defaultdict(dict)
-    var_objs = []
-    for name in names:
-        variable_dict[name]['name'] = name
+def read_pdf_text_ocr(pdf_fp, regen_text=False, workers=1, cache_images=False):
+    """
+    returns ocr text of PDF as one String, pages delimited by PAGE_BREAK
+        (see iter_pdf_page_texts)
+    """
+    pages = iter_pdf_page_texts(pdf_fp, text_source='ocr', regen_text=regen_text,
+                                workers=workers, cache_images=cache_images)
+    return ''.join(f'{page_text}{PAGE_BREAK}' for page_text in pages)
 
-        if len(descriptions) == 0:
-            descriptions.append('ran out of descriptions') # precaution
+def read_pdf_text_hybrid(pdf_fp, regen_text=False, workers=1):
+    """
+    returns text of PDF from text layer + ocr as one String, pages delimited by PAGE_BREAK
+        (see iter_pdf_page_texts)
+    """
+    pages = iter_pdf_page_texts(pdf_fp, text_source='hybrid', regen_text=regen_text,
+                                workers=workers)
+    return ''.join(f'{page_text}{PAGE_BREAK}' for page_text in pages)
 
-        variable_dict[name]['description'] = descriptions[0]
-        descriptions = descriptions[1:]
+def remove_page_numbers(text):
+    """
+    uses regex to remove page numbers from inputted String
+    """
+    pattern = r'Page \d+ of \d+'
+    return re.sub(pattern, '', text)
 
-        variable_dict[name]['values'] = name_to_table[name]['table']
-        var_objs.append(Variable(name, variable_dict[name]['description'],
-                                    variable_dict[name]['values'], total))
+def read_description(desc_text, final=True):
+    """
+    takes text following an appearance of "Description:"
+        reads line by line until text of line indicates description has concluded
+    returns description (str)
+    final: False if more text may still be appended to desc_text (e.g. next page not read yet)
+        then the last (possibly incomplete) line is not read,
+        and None is returned if no line has concluded the description yet
+    """
+    desc_text = remove_page_numbers(desc_text)
+    lines = desc_text.split('\n')
+    if not final:
+        lines = lines[:-1]
+
+    desc = ''
+    concluded = False
+    for line in lines:
+        line = line.strip()
+
+        if ('Description' in line or 'Code or Value' in line or
+        (re.search('[A-Z]', line) is not None and line.upper() == line and ' ' not in line)):
+            concluded = True
+            break
+
+        desc_line = re.sub(r' {2,}', ' ', line.strip())
+        desc += f'{desc_line} '
+
+    if not final and not concluded:
+        return None
+    if desc.strip() == '' or desc.lower().strip() == 'units:':
+        return '!MANUALLY INPUT DESCRIPTION!'
+    return desc.strip()
 
-    print(f'Writing to xlsx... ({':'.join(date_ext(full=True).split('_')[1:])})')
-    write_variables_to_xlsx(pdf_fp, var_objs)
+def get_descriptions(text):
+    """
+    pulls text from after appearances of "Description:" in text (see read_description)
+    (assuming for now that description is not split over a pagebreak)
+    """
+    return [read_description(desc_text) for desc_text in text.split('Description:')[1:]]
 
-    print(f'Done! ({':'.join(date_ext(full=True).split('_')[1:])})')
+def iter_descriptions(page_texts):
+    """
+    generator version of get_descriptions for text that arrives a page at a time
+    takes iterable of page texts in page order (e.g. iter_pdf_page_texts)
+    yields (page number, description) for each appearance of "Description:", in order,
+        as soon as the description has concluded (usually on the page it starts on)
+    only the text of the description currently being read is kept
+    """
+    desc_text, desc_pg_num = None, None
+    for pg_num, page_text in enumerate(page_texts):
+        parts = f'{page_text}{PAGE_BREAK}'.split('Description:')
+        for i, part in enumerate(parts):
+            if i > 0:
+                # new "Description:", previous one is complete
+                if desc_text is not None:
+                    yield desc_pg_num, read_description(desc_text)
+                desc_text, desc_pg_num = '', pg_num
+
+            if desc_text is None:
+                continue
+            desc_text += part
+
+            if i+1 == len(parts):
+                # rest of description would be on next page, check whether it already concluded
+                desc = read_description(desc_text, final=False)
+                if desc is not None:
+                    yield desc_pg_num, desc
+                    desc_text = None
+
+    if desc_text is not None:
+        yield desc_pg_num, read_description(desc_text)
+
+def write_variables_to_xlsx(fp, variables):
+    """
+    takes in str representing fp and list of variables objects
+    collects a row per variable (see Variable.to_row) into one DataFrame
+        (built once, linear in number of variables)
+    writes df to xlsx in created directories
+    returns path of written xlsx
+    (see output_writers.write_variables for other formats)
+    """
+    return write_variables(fp, variables, ['xlsx'])['xlsx'][0]
+
+def collect_names_and_tables(pdf_fp, workers=1, word_backend=DEFAULT_WORD_BACKEND, budget=None,
+                             find_regions=False):
+    """
+    takes str representing path to PDF
+    returns tuple
+        - num observations (see get_num_observations)
+        - dict binding names to their table (see map_var_to_table)
+        - list of names in the order they appear in the PDF
+        - dict, page number -> how page's table finding went over budget (see page_budgets.py)
+        - dict, page number -> whether and how long page was searched for tables
+          (see DocumentSession.table_searches)
+        - description regions found from the names and tables (see get_description_regions),
+          None unless find_regions
+    runs in a thread of its own alongside reading the text (see write_pdf_vars_to_xlsx),
+        so it has its own document session
+    """
+    with (span('names and tables'),
+          document_session(pdf_fp, word_backend, budget) as session):
+        # before names, so page 1 words are extracted once for both
+        total = get_num_observations(pdf_fp)
+        tables_and_names = get_all_tables_and_names_by_page_by_ycoord(pdf_fp, workers=workers)
+        # before names are bound to tables (which removes them from tables_and_names)
+        regions_by_pg_num = (get_description_regions(pdf_fp, tables_and_names=tables_and_names)
+                             if find_regions else None)
+        name_to_table = map_var_to_table(pdf_fp, tables_and_names=tables_and_names)
+        degraded = dict(session.degraded)
+        table_searches = dict(session.table_searches)
+    names = sorted(name_to_table, key=lambda name: name_to_table[name]['location'])
+
+    return total, name_to_table, names, degraded, table_searches, regions_by_pg_num
+
+def iter_noting_degraded(page_texts, session):
+    """
+    generator, takes iterable of page texts in page order (e.g. iter_pdf_page_texts)
+    and document session to record pages whose ocr went over budget in (see ocr_session_page)
+        (pages read in worker processes or from the cache only carry the marker)
+    yields page texts unchanged
+    """
+    for pg_num, page_text in enumerate(page_texts):
+        if DEGRADED_PAGE in page_text:
+            session.degraded.setdefault(pg_num, ['ocr over budget'])
+        yield page_text
+
+def write_pdf_vars_to_xlsx(pdf_fp, regen_text=False, workers=1, cache_images=False,
+                           text_source='ocr', output_formats=('xlsx',),
+                           word_backend=DEFAULT_WORD_BACKEND, page_seconds=DEFAULT_PAGE_SECONDS,
+                           document_seconds=None):
+    """
+    takes str representing reletive path to coding manual PDF
+    writes xlsx data dictionary using above methods, returns its path
+    output_formats: formats to write data dictionary in (see output_writers.OUTPUT_WRITERS)
+        all written from one extraction, path returned is that of the first format's
+    workers: number of processes used for ocr, and for table finding (1 = serial)
+    cache_images: if True, keeps rendered page pngs in pdf_to_image/ (for debugging)
+    text_source: where description text comes from
+        - 'ocr': ocr every page (read_pdf_text_ocr)
+        - 'hybrid': native text layer, ocr only pages without one (read_pdf_text_hybrid)
+        - 'regions': ocr only the description regions of each page (iter_region_pages)
+    word_backend: how words (variable names) are pulled from pages (see word_backends.py)
+    page_seconds, document_seconds: time budgets of one page's table finding / ocr and of the
+        whole PDF (None = no limit), pages over budget are read a cheaper way or not at all,
+        noted on their variables and recorded in the document session (DocumentSession.degraded)
+        (a session that is already open, e.g. batch_process's, keeps its own budgets)
+    names and tables are collected (see collect_names_and_tables) while the text is read,
+        the two only meet when names are paired with descriptions (descriptions read before
+        names are in wait for them, the rest are paired as they are read)
+        (except for 'regions', whose text is found from names and tables, and the 'pymupdf'
+        word backend, which cannot run in two threads at once)
+    the PDF is opened once per stage and shared by everything in it (see document_session.py)
+    stage timings: see instrumentation.py
+    """
+    check_output_formats(output_formats)
+    budget = Budget(page_seconds, document_seconds)
+    with (span('write_pdf_vars_to_xlsx', pdf=os.path.basename(pdf_fp), text_source=text_source,
+               word_backend=word_backend),
+          document_session(pdf_fp, word_backend, budget) as session,
+          ThreadPoolExecutor(max_workers=1) as executor):
+        print('Collecting names and tables...')
+        names_and_tables = executor.submit(collect_names_and_tables, pdf_fp, workers=workers,
+                                           word_backend=word_backend, budget=session.budget,
+                                           find_regions=text_source == 'regions')
+        regions_by_pg_num = None
+        if text_source == 'regions' or session.word_backend == 'pymupdf':
+            # nothing to overlap: regions are found from names and tables, and pymupdf is not
+            # thread safe (its context is process wide), names would be pulled with it while
+            # pages are rendered
+            regions_by_pg_num = names_and_tables.result()[-1]
+
+        print('Reading PDF...')
+        with span('text and descriptions'):
+            page_texts = iter_pdf_page_texts(pdf_fp, text_source=text_source, regen_text=regen_text,
+                                             workers=workers, cache_images=cache_images,
+                                             regions_by_pg_num=regions_by_pg_num)
+            descriptions = iter_descriptions(iter_noting_degraded(page_texts, session))
+            # descriptions read while names and tables are collected are kept until those are in,
+            # the rest are paired as they are read (only one page's text is held from then on)
+            read_descriptions = []
+            if not names_and_tables.done():
+                for description in descriptions:
+                    read_descriptions.append(description)
+                    if names_and_tables.done():
+                        break
+
+        with span('wait for names and tables'):
+            total, name_to_table, names, degraded_tables, table_searches, _ = names_and_tables.result()
+
+        # pages degraded in the other stage (or in worker processes) are recorded here too
+        session.table_searches.update(table_searches)
+        for pg_num, reasons in degraded_tables.items():
+            page_reasons = session.degraded.setdefault(pg_num, [])
+            page_reasons.extend(reason for reason in reasons if reason not in page_reasons)
+
+        print('Creating variable objects...')
+        with span('pair names and descriptions'):
+            descriptions = itertools.chain(read_descriptions, descriptions)
+            var_objs = []
+            var_pg_nums = []
+            for name in names:
+                # precaution
+                desc_pg_num, description = next(descriptions, (None, 'ran out of descriptions'))
+                var_pg_nums.append({name_to_table[name]['page'], desc_pg_num} - {None})
+                var_objs.append(Variable(name, description, name_to_table[name]['table'], total))
+            count('variables', len(var_objs))
+            for _ in descriptions:
+                pass # reads (and caches) the rest of the text, pages over budget are noted too
+
+            # noted once all text is read, a variable's table can be on a page read after it
+            for var_obj, pg_nums in zip(var_objs, var_pg_nums):
+                var_obj.degraded = [f'page {pg_num+1} {reason}' for pg_num in sorted(pg_nums)
+                                    for reason in session.degraded.get(pg_num, [])]
+
+        print(f'Writing to {', '.join(output_formats)}...')
+        with span('write outputs'):
+            fps_out = write_variables(pdf_fp, var_objs, output_formats)
+        fp_out = fps_out[output_formats[0]][0]
+
+        num_skipped = sum(skip_reason is not None
+                          for skip_reason, _ in session.table_searches.values())
+        if num_skipped:
+            print(f'{num_skipped} of {len(session.table_searches)} pages could not hold a table, '
+                  f'skipped table finding on them '
+                  f'(~{estimate_skipped_table_seconds(session.table_searches):.2f}s saved)')
+        if session.degraded:
+            print(f'{len(session.degraded)} pages went over budget (noted on their variables): '
+                  f'{', '.join(str(pg_num+1) for pg_num in sorted(session.degraded))}')
+    print(f'Done! (peak memory {get_peak_rss_mb()} MB)')
+    return fp_out
 
 def main():
     """
@@ -0,0 +1,209 @@
+"""
+document_session.py
+module for sharing one opened PDF between all stages of a run
+a session owns the pdfplumber and pymupdf handles of a PDF (each opened on first use)
+and memoizes what is parsed from its pages (words, tables, page sizes), so no page is parsed twice
+it also holds the run's time budgets, and which pages went over them (see page_budgets.py)
+NOTE: sessions belong to the process and thread that opened them, worker processes (and stages
+      running in threads of their own) open their own (see open_worker_session),
+      page renders are not kept (each page is only rendered once)
+"""
+
+import multiprocessing
+import os
+import threading
+from contextlib import contextmanager
+import pdfplumber
+from instrumentation import span, count
+from page_budgets import Budget, run_within_budget, time_budget
+from word_backends import DEFAULT_WORD_BACKEND, WORD_BACKENDS, check_word_backend
+
+# (process id, thread id, absolute path of PDF) -> session open in that thread
+_sessions = {}
+
+# start method of worker pools (see open_worker_session), pools are started while another stage
+# runs in a thread of its own (see write_pdf_vars_to_xlsx), and a process forked with threads
+# running can hang on a lock one of them held (e.g. stdout's), so workers are forked from a
+# server process with no threads instead (spawned where there is none, e.g. Windows)
+WORKER_MP_CONTEXT = multiprocessing.get_context(
+    'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn')
+if WORKER_MP_CONTEXT.get_start_method() == 'forkserver':
+    # imported once by the server, not by every worker
+    WORKER_MP_CONTEXT.set_forkserver_preload(['__main__', 'cmanual_pdf_to_data_dict'])
+
+class DocumentSession:
+    """
+    Class to hold the open handles of a PDF and what has been parsed from its pages
+    Fields:
+        - pdf_fp: str, path to PDF
+        - word_backend: str, key of word_backends.WORD_BACKENDS words are pulled with
+        - words: dict, page number -> words on page (see page_words)
+        - tables: dict, page number -> tables found by pdfplumber's table finder (see page_tables)
+        - page_rects: dict, page number -> pymupdf rect of page (see page_rect)
+        - budget: page_budgets.Budget, time budgets of the run
+        - degraded: dict, page number -> list of str, how page went over budget (see degrade)
+        - table_searches: dict, page number -> tuple (why table finding was skipped (None if it
+          was not), seconds spent on it) (see extract_tables_and_var_names.py)
+    """
+    def __init__(self, pdf_fp, word_backend=DEFAULT_WORD_BACKEND, budget=None):
+        check_word_backend(word_backend)
+        self.pdf_fp = pdf_fp
+        self.word_backend = word_backend
+        self.budget = budget if budget is not None else Budget()
+        self.words = {}
+        self.tables = {}
+        self.page_rects = {}
+        self.degraded = {}
+        self.table_searches = {}
+        self._pdf = None
+        self._document = None
+
+    @property
+    def pdf(self):
+        """
+        pdfplumber pdf object, opened on first use
+        """
+        if self._pdf is None:
+            self._pdf = pdfplumber.open(self.pdf_fp)
+        return self._pdf
+
+    @property
+    def document(self):
+        """
+        pymupdf document object, opened on first use (pymupdf is only needed for current format)
+        """
+        if self._document is None:
+            import pymupdf
+            self._document = pymupdf.open(self.pdf_fp)
+        return self._document
+
+    @property
+    def num_pages(self):
+        """
+        number of pages in PDF (from whichever handle is already open)
+        """
+        if self._document is not None:
+            return len(self._document)
+        return len(self.pdf.pages)
+
+    def page_words(self, pg_num):
+        """
+        returns words on page (see word_backends.py), extracted on first use
+        """
+        if pg_num not in self.words:
+            with span('extract_words', page=pg_num, backend=self.word_backend):
+                self.words[pg_num] = WORD_BACKENDS[self.word_backend](self, pg_num)
+        return self.words[pg_num]
+
+    def page_tables(self, pg_num):
+        """
+        returns pdfplumber table objects found on page (debug_tablefinder), found on first use
+        within the page budget, over budget (e.g. dense vector art) tables are found on the page's
+        rects only (what the manuals' tables are drawn with), then given up on (no tables)
+        """
+        if pg_num not in self.tables:
+            page = self.pdf.pages[pg_num]
+            rects_page = lambda: page.filter(lambda obj: obj['object_type'] == 'rect')
+            with span('debug_tablefinder', page=pg_num):
+                tables, degraded = run_within_budget(self.budget, [
+                    ('table finding', lambda seconds: find_tables(page, seconds)),
+                    ('table finding on rects', lambda seconds: find_tables(rects_page(), seconds)),
+                ], fallback=[])
+            if degraded is not None:
+                self.degrade(pg_num, degraded)
+            self.tables[pg_num] = tables
+        return self.tables[pg_num]
+
+    def page_rect(self, pg_num):
+        """
+        returns pymupdf rect of page (x0, y0, x1, y1 in points)
+        """
+        if pg_num not in self.page_rects:
+            self.page_rects[pg_num] = self.document.load_page(pg_num).rect
+        return self.page_rects[pg_num]
+
+    def degrade(self, pg_num, reason):
+        """
+        records that page went over budget (reason: str, e.g. output of run_within_budget)
+        """
+        print(f'page {pg_num+1} degraded: {reason}')
+        self.degraded.setdefault(pg_num, []).append(reason)
+        count('degraded pages')
+
+    def release_page(self, pg_num):
+        """
+        drops everything parsed from page (its pdfplumber objects, words and tables)
+        call once a stage is done with a page, so a run holds one page at a time
+        """
+        if self._pdf is not None:
+            self._pdf.pages[pg_num].close()
+        self.words.pop(pg_num, None)
+        self.tables.pop(pg_num, None)
+
+    def close(self):
+        """
+        closes the open handles, drops everything memoized
+        """
+        if self._pdf is not None:
+            self._pdf.close()
+            self._pdf = None
+        if self._document is not None:
+            self._document.close()
+            self._document = None
+        self.words.clear()
+        self.tables.clear()
+        self.page_rects.clear()
+
+def find_tables(page, seconds=None):
+    """
+    takes pdfplumber page (or filtered page) and seconds it may take (None = no limit)
+    returns table objects pdfplumber's table finder finds on it
+    raises page_budgets.BudgetExceeded if it takes longer
+        only the table finder is timed: the page's objects (and edges, all it reads of the page)
+        are parsed before, so an interrupt never leaves the page (or pdfminer) half parsed
+    """
+    page.edges # memoized on page
+    with time_budget(seconds):
+        return page.debug_tablefinder().tables
+
+def get_session_key(pdf_fp):
+    """
+    returns key of session for PDF in this process and thread (see _sessions)
+        pdfplumber/pymupdf objects are not safe to share between threads
+    """
+    return (os.getpid(), threading.get_ident(), os.path.abspath(pdf_fp))
+
+@contextmanager
+def document_session(pdf_fp, word_backend=None, budget=None):
+    """
+    takes str representing path to PDF (and optionally the word backend to use, and the
+    page_budgets.Budget of a new session, an open session keeps the budget it was opened with)
+    returns context manager giving the session already open for that PDF in this thread,
+    or a new one (closed on exit) if there is none, so nested stages share one session
+        usage: with document_session(pdf_fp) as session: ...
+    raises ValueError if the open session uses a different word backend than asked for
+    """
+    key = get_session_key(pdf_fp)
+    if key in _sessions:
+        session = _sessions[key]
+        if word_backend is not None and word_backend != session.word_backend:
+            raise ValueError(f'{pdf_fp} is already open with word backend {session.word_backend}')
+        yield session
+        return
+
+    session = DocumentSession(pdf_fp, word_backend or DEFAULT_WORD_BACKEND, budget)
+    _sessions[key] = session
+    try:
+        yield session
+    finally:
+        del _sessions[key]
+        session.close()
+
+def open_worker_session(pdf_fp, word_backend=DEFAULT_WORD_BACKEND, budget=None):
+    """
+    takes str representing path to PDF (and the word backend and budget to use)
+    opens a session for it that lasts as long as the process
+    (initializer of worker pools, so a worker opens the PDF once instead of once per task)
+        pools are started with WORKER_MP_CONTEXT
+    """
+    _sessions[get_session_key(pdf_fp)] = DocumentSession(pdf_fp, word_backend, budget)
@@ -4,18 +4,42 @@ module for extracting/reading tables and parsing variable names from coding manu
 """
 
 import re
-from collections import defaultdict
-import pdfplumber
+import time
+from bisect import bisect_left, bisect_right
+from collections import defaultdict, namedtuple
+from contextlib import nullcontext
+from concurrent.futures import ProcessPoolExecutor
+from pdfplumber.utils import clip_obj, extract_words
+from document_session import WORKER_MP_CONTEXT, document_session, open_worker_session
+from extraction_cache import cached, iter_cached_pages
+from word_backends import get_backend_stage
+from instrumentation import span, count
+
+# picklable stand-in for a pdfplumber table (only its bbox is used once tables are parsed)
+TableOutline = namedtuple('TableOutline', ['bbox'])
+
+# why table finding was skipped on a page (see get_table_search_skip_reason)
+NO_NAMES_NEARBY = 'no variable names nearby'
+NO_TABLE_LINES = 'no lines, rects or curves'
 
 def get_num_observations(pdf_fp):
     """
     uses regex to search for indicators of num observations
     outputs int repreeenting num observations if found
         else None
+    result is reused from extraction cache if this exact PDF was read before
     """
-    with pdfplumber.open(pdf_fp) as pdf:
-        page = pdf.pages[0]
-        text_data = page.extract_words()
+    with document_session(pdf_fp) as session:
+        return cached(pdf_fp, get_backend_stage('num_observations', session.word_backend),
+                      lambda: find_num_observations(pdf_fp))
+
+def find_num_observations(pdf_fp):
+    """
+    does the work of get_num_observations (uncached)
+    page 1 words are shared with name extraction through the document session
+    """
+    with document_session(pdf_fp) as session:
+        text_data = session.page_words(0)
 
         words = [t['text'].lower() for t in text_data]
 
@@ -33,9 +57,44 @@ def get_num_observations(pdf_fp):
 
     return None
 
-def get_tables_on_page_by_ycoord(pdf, pg_num):
+def index_chars_by_top(chars):
+    """
+    takes list of pdfplumber char objects (e.g. page.chars)
+    outputs dict indexing chars by their distance to top of page, for extract_words_in_bbox
+        'chars': chars
+        'order': indices of chars, sorted by top
+        'tops': tops of chars, in order of 'order'
+        'max_height': height of tallest char
+    """
+    order = sorted(range(len(chars)), key=lambda i: chars[i]['top'])
+    return {'chars': chars,
+            'order': order,
+            'tops': [chars[i]['top'] for i in order],
+            'max_height': max((char['bottom'] - char['top'] for char in chars), default=0)}
+
+def extract_words_in_bbox(char_index, bbox):
+    """
+    takes output of index_chars_by_top and bbox (x0, top, x1, bottom)
+    outputs same words as page.crop(bbox).extract_words()
+        but only looks at chars that can overlap bbox instead of every char on the page
+    """
+    _, top, _, bottom = bbox
+    tops = char_index['tops']
+    start = bisect_left(tops, top - char_index['max_height'])
+    end = bisect_right(tops, bottom)
+
+    # crop keeps page order of chars, clipped to bbox
+    in_bbox = []
+    for i in sorted(char_index['order'][start:end]):
+        clipped = clip_obj(char_index['chars'][i], bbox)
+        if clipped is not None:
+            in_bbox.append(clipped)
+
+    return extract_words(in_bbox)
+
+def get_tables_on_page_by_ycoord(session, pg_num):
     """
-    takes pdfplumber pdf object and int (falling in range(<number of pages in pdf>)
+    takes document session (see document_session.py) and page number
     outputs:
     - dict
         - keys: distances from table to top of page (float)
@@ -44,34 +103,42 @@ def get_tables_on_page_by_ycoord(pdf, pg_num):
                 'parsed': parsed table (see parse_table_cells)
                 'raw_table': pdfplumber table object
     """
-    pg = pdf.pages[pg_num]
-    tables = pg.debug_tablefinder().tables
+    pg = session.pdf.pages[pg_num]
+    tables = session.page_tables(pg_num)
 
     final = defaultdict(dict)
+    if not tables:
+        return dict(final)
+
+    char_index = index_chars_by_top(pg.chars)
     for table in tables:
-        copy = pdf.pages[pg_num]
         cells = table.cells
         table_contents = []
-        ycoord = copy.crop(table.bbox).extract_words()[0]['top']
-        for cell in cells:
-            extract_words = pg.crop(cell).extract_words()
-            cell_words = ''
-            for word in extract_words:
-                cell_words += f'{word['text']} '
-            cell_words = cell_words.rstrip()
-            if cell_words == '':
-                continue
-            table_contents.append(cell_words)
+        with span('cell extraction', page=pg_num, cells=len(cells)):
+            table_words = extract_words_in_bbox(char_index, table.bbox)
+            if not table_words:
+                continue # no text (e.g. a chart's grid), cannot hold coded values
+            ycoord = table_words[0]['top']
+            for cell in cells:
+                cell_words = ''
+                for word in extract_words_in_bbox(char_index, cell):
+                    cell_words += f'{word['text']} '
+                cell_words = cell_words.rstrip()
+                if cell_words == '':
+                    continue
+                table_contents.append(cell_words)
+        count('cells', len(cells))
 
         parsed = parse_table_cells(table_contents)
         if parsed is None:
             continue
+        count('tables')
         final[ycoord]['parsed'] = parsed
         final[ycoord]['raw_table'] = table
 
     return dict(final)
 
-def get_all_tables_by_page_by_ycoord(pdf):
+def get_all_tables_by_page_by_ycoord(session):
     """
     wrapper method
     calls get_tables_on_page_by_ycoord on all pages of pdf at pdf_fp
@@ -82,8 +149,8 @@ def get_all_tables_by_page_by_ycoord(pdf):
     """
 
     tables_by_pg_num = {}
-    for pg_num in range(len(pdf.pages)):
-        tables_by_pg_num[pg_num] = get_tables_on_page_by_ycoord(pdf, pg_num)
+    for pg_num in range(session.num_pages):
+        tables_by_pg_num[pg_num] = get_tables_on_page_by_ycoord(session, pg_num)
 
     return tables_by_pg_num
 
@@ -105,17 +172,15 @@ def fix_split_tables(tables_by_pg_num):
                         break
                 break
 
-def get_varnames_on_page_by_ycoord(pdf, pg_num):
+def get_varnames_on_page_by_ycoord(session, pg_num):
     """
-    takes pdfplumber pdf object and int (falling in range(<number of pages in pdf>)
+    takes document session (see document_session.py) and page number
     outputs:
     - dict
         - keys: distances from table to top of page (float)
         - values: variable name at that distance
     """
-    page = pdf.pages[pg_num]
-
-    text_data = page.extract_words()
+    text_data = session.page_words(pg_num)
 
     ycoord_name = {}
 
@@ -135,7 +200,7 @@ def get_varnames_on_page_by_ycoord(pdf, pg_num):
     # print(ycoord_name)
     return ycoord_name
 
-def get_all_varnames_by_page_by_ycoord(pdf):
+def get_all_varnames_by_page_by_ycoord(session):
     """
     wrapper method
     calls get_varnames_on_page_by_ycoord on all pages of pdf at pdf_fp
@@ -145,69 +210,230 @@ def get_all_varnames_by_page_by_ycoord(pdf):
         values: output of get_varnames_on_page_by_ycoord for that page
     """
     vars_by_pg_num = {}
-    for pg_num in range(len(pdf.pages)):
-        vars_by_pg_num[pg_num] = get_varnames_on_page_by_ycoord(pdf, pg_num)
+    for pg_num in range(session.num_pages):
+        vars_by_pg_num[pg_num] = get_varnames_on_page_by_ycoord(session, pg_num)
 
     return vars_by_pg_num
 
-def get_all_tables_and_names_by_page_by_ycoord(pdf_fp):
+def get_table_search_skip_reason(session, pg_num, vars_by_pg_num):
+    """
+    takes document session, page number and dict of names found so far
+        (page number -> output of get_varnames_on_page_by_ycoord)
+    returns str why page cannot hold a table map_var_to_table would use, None if it can
+        - NO_NAMES_NEARBY: no variable names on it, 2 pages before or the page after
+          (tables are paired with names on their own page or the page before, merged into
+          tables ending the page before, and take tables starting the page after with them,
+          see map_var_to_table and fix_split_tables), pages whose names are not in
+          vars_by_pg_num count as having names
+        - NO_TABLE_LINES: no lines, rects or curves on it (what pdfplumber finds tables from)
+    """
+    nearby = range(max(pg_num-2, 0), min(pg_num+2, session.num_pages))
+    if not any(vars_by_pg_num.get(nearby_pg_num, True) for nearby_pg_num in nearby):
+        return NO_NAMES_NEARBY
+    if not session.pdf.pages[pg_num].edges:
+        return NO_TABLE_LINES
+    return None
+
+def get_tables_and_names_on_pages(pdf_fp, pg_nums):
+    """
+    takes str representing path to PDF and sorted list of page numbers
+    uses the document session for the PDF (opened here if there is none, e.g. in a worker process)
+    returns outputs of get_varnames_on_page_by_ycoord and get_tables_on_page_by_ycoord
+    for those pages, how each page was degraded (list of str, empty if it was not, see
+    DocumentSession.degrade) and tuple (why table finding was skipped (None if it was not, see
+    get_table_search_skip_reason), seconds spent on it) (dicts keyed by page number)
+        'raw_table's are replaced by TableOutline so the results can be pickled
+    each page's parsed objects are released once its results are extracted
+        (the next page's names are found first, so two pages are held at a time)
+    """
+    vars_by_pg_num = {}
+    tables_by_pg_num = {}
+    degraded_by_pg_num = {}
+    table_search_by_pg_num = {}
+    in_pg_nums = set(pg_nums)
+    with document_session(pdf_fp) as session:
+        for pg_num in pg_nums:
+            with span('tables and names page', page=pg_num):
+                for names_pg_num in (pg_num, pg_num+1):
+                    if names_pg_num in in_pg_nums and names_pg_num not in vars_by_pg_num:
+                        vars_by_pg_num[names_pg_num] = get_varnames_on_page_by_ycoord(session,
+                                                                                      names_pg_num)
+
+                start = time.perf_counter()
+                skip_reason = get_table_search_skip_reason(session, pg_num, vars_by_pg_num)
+                if skip_reason is None:
+                    tables = get_tables_on_page_by_ycoord(session, pg_num)
+                    for table_info in tables.values():
+                        table_info['raw_table'] = TableOutline(table_info['raw_table'].bbox)
+                else:
+                    tables = {}
+                    count('pages skipped by table pre-filter')
+                tables_by_pg_num[pg_num] = tables
+                table_search_by_pg_num[pg_num] = (skip_reason, time.perf_counter() - start)
+                degraded_by_pg_num[pg_num] = session.degraded.get(pg_num, [])
+
+                # results are plain dicts now, drop the page's parsed objects
+                session.release_page(pg_num)
+                count('pages')
+
+    return vars_by_pg_num, tables_by_pg_num, degraded_by_pg_num, table_search_by_pg_num
+
+def is_page_result_reusable(page_result):
+    """
+    takes tuple of results of a page (see iter_tables_and_names_on_pages)
+    returns whether they can be stored and reused for the same page in another PDF
+        not if page went over budget, or table finding was skipped because of the names
+        on other pages (which may differ in another PDF)
+    """
+    _, _, degraded, (skip_reason, _) = page_result
+    return not degraded and skip_reason != NO_NAMES_NEARBY
+
+def estimate_skipped_table_seconds(table_searches):
+    """
+    takes dict, page number -> tuple (why table finding was skipped, seconds spent on it)
+        (see DocumentSession.table_searches)
+    returns estimate of seconds the pre-filter saved: pages it skipped times the average
+    seconds table finding took on the other pages (0.0 if it skipped or found on none)
+    """
+    searched_seconds = [seconds for skip_reason, seconds in table_searches.values()
+                        if skip_reason is None]
+    num_skipped = len(table_searches) - len(searched_seconds)
+    if not num_skipped or not searched_seconds:
+        return 0.0
+    return num_skipped * sum(searched_seconds) / len(searched_seconds)
+
+def get_all_tables_and_names_by_page_by_ycoord(pdf_fp, workers=1):
     """
     wrapper method
-    returns outputs of:
+    returns outputs of (see get_tables_and_names_on_pages):
         - get_varnames_on_page_by_ycoord
         - get_tables_on_page_by_ycoord
+    if workers > 1, ranges of pages are spread across that many worker processes
+    results are reused from extraction cache if this exact PDF was read before
+        (or, page by page, for pages unchanged from a previously read version of it)
+        results of pages that went over budget are not stored (see DocumentSession.degraded)
+    pages that cannot hold a table with coded values are not searched for tables
+        (see get_table_search_skip_reason)
     """
-    with pdfplumber.open(pdf_fp) as pdf:
-        vars_by_pg_num = {}
-        tables_by_pg_num = {}
-        for pg_num in range(len(pdf.pages)):
-            vars_by_pg_num[pg_num] = get_varnames_on_page_by_ycoord(pdf, pg_num)
-            tables_by_pg_num[pg_num] = get_tables_on_page_by_ycoord(pdf, pg_num)
+    with document_session(pdf_fp) as session:
+        # how table finding went on each page is stored with the results, so a cached run
+        # reports the same skipped pages (see DocumentSession.table_searches)
+        vars_by_pg_num, tables_by_pg_num, table_searches = cached(
+            pdf_fp, get_backend_stage('tables_and_names', session.word_backend),
+            lambda: (*find_all_tables_and_names_by_page_by_ycoord(pdf_fp, workers=workers),
+                     dict(session.table_searches)),
+            keep=lambda _: not session.degraded)
+        session.table_searches.update(table_searches)
 
     return vars_by_pg_num, tables_by_pg_num
 
-def map_var_to_table(pdf_fp):
+def find_all_tables_and_names_by_page_by_ycoord(pdf_fp, workers=1):
+    """
+    does the work of get_all_tables_and_names_by_page_by_ycoord (uncached for whole PDF)
+    only reads pages with no stored results (see iter_cached_pages)
+    pages degraded in worker processes (and how table finding went on each page) are recorded
+    in this thread's session too
+    """
+    vars_by_pg_num = {}
+    tables_by_pg_num = {}
+    with document_session(pdf_fp) as session:
+        stage = get_backend_stage('page_tables_and_names', session.word_backend)
+        page_results = iter_cached_pages(pdf_fp, stage,
+                                         lambda pg_nums: iter_tables_and_names_on_pages(
+                                             pdf_fp, pg_nums, workers=workers),
+                                         keep=is_page_result_reusable)
+        for pg_num, (page_vars, page_tables, page_degraded, table_search) in enumerate(page_results):
+            vars_by_pg_num[pg_num] = page_vars
+            tables_by_pg_num[pg_num] = page_tables
+            if page_degraded and pg_num not in session.degraded:
+                session.degraded[pg_num] = page_degraded
+            session.table_searches[pg_num] = table_search
+
+    return vars_by_pg_num, tables_by_pg_num
+
+def iter_tables_and_names_on_pages(pdf_fp, pg_nums, workers=1):
+    """
+    generator, takes str representing path to PDF and list of page numbers
+    yields tuple (get_varnames_on_page_by_ycoord output, get_tables_on_page_by_ycoord output,
+    how page was degraded, how table finding went) for each of those pages, in order
+    (see get_tables_and_names_on_pages)
+    if workers > 1, ranges of pages are spread across that many worker processes
+    """
+    if workers <= 1:
+        pg_ranges = [pg_nums]
+    else:
+        # a few ranges per worker so one slow range does not hold up the rest
+        range_size = max(1, -(-len(pg_nums) // (workers*4)))
+        pg_ranges = [pg_nums[start:start+range_size] for start in range(0, len(pg_nums), range_size)]
+
+    with document_session(pdf_fp) as session:
+        # workers pull words the same way, within the same budgets
+        word_backend, budget = session.word_backend, session.budget
+
+    with (ProcessPoolExecutor(max_workers=workers, mp_context=WORKER_MP_CONTEXT,
+                              initializer=open_worker_session,
+                              initargs=(pdf_fp, word_backend, budget))
+          if workers > 1 else nullcontext()) as executor:
+        if executor is not None:
+            results = executor.map(get_tables_and_names_on_pages, [pdf_fp]*len(pg_ranges), pg_ranges)
+        else:
+            results = (get_tables_and_names_on_pages(pdf_fp, pg_range) for pg_range in pg_ranges)
+
+        for pg_range, range_results in zip(pg_ranges, results):
+            range_vars, range_tables, range_degraded, range_table_searches = range_results
+            for pg_num in pg_range:
+                yield (range_vars[pg_num], range_tables[pg_num], range_degraded[pg_num],
+                       range_table_searches[pg_num])
+
+def map_var_to_table(pdf_fp, workers=1, tables_and_names=None):
     """
     parses outputs of get_varnames_on_page_by_ycoord and get_tables_on_page_by_ycoord
     fixes split tables
     outputs dictionary binding varnames to their table
         binds based on y distance between name and table
+    workers: number of processes pages are spread across (1 = serial)
+    tables_and_names: output of get_all_tables_and_names_by_page_by_ycoord, if already found
+        (tables are merged and removed from it as they are bound)
     """
-    vars_by_pg_num, tables_by_pg_num = get_all_tables_and_names_by_page_by_ycoord(pdf_fp)
-    fix_split_tables(tables_by_pg_num)
-
-    name_to_table = defaultdict(dict)
-    for pg_num, ycoords_names in vars_by_pg_num.items():
-        names_on_page = ycoords_names.values()
-        ycoords_tables = tables_by_pg_num[pg_num]
-        for name_y, name in ycoords_names.items():
-            var_codes = None
-            for table_y, table_info in ycoords_tables.items():
-                if table_y > name_y:
-                    if (table_y - name_y) > 140:
-                        break
-                    parsed = table_info['parsed']
-
-                    code_values = [code_info['Description'] for code_info in parsed.values()]
-                    bad_table = False
-                    for n in names_on_page:
-                        if n.upper() in code_values:
-                            bad_table = True
-                    if bad_table:
+    if tables_and_names is None:
+        tables_and_names = get_all_tables_and_names_by_page_by_ycoord(pdf_fp, workers=workers)
+    vars_by_pg_num, tables_by_pg_num = tables_and_names
+    with span('map_var_to_table'):
+        fix_split_tables(tables_by_pg_num)
+
+        name_to_table = defaultdict(dict)
+        for pg_num, ycoords_names in vars_by_pg_num.items():
+            names_on_page = ycoords_names.values()
+            ycoords_tables = tables_by_pg_num[pg_num]
+            for name_y, name in ycoords_names.items():
+                var_codes = None
+                for table_y, table_info in ycoords_tables.items():
+                    if table_y > name_y:
+                        if (table_y - name_y) > 140:
+                            break
+                        parsed = table_info['parsed']
+
+                        code_values = [code_info['Description'] for code_info in parsed.values()]
+                        bad_table = False
+                        for n in names_on_page:
+                            if n.upper() in code_values:
+                                bad_table = True
+                        if bad_table:
+                            break
+
+                        var_codes = parsed
+                        del ycoords_tables[table_y]
                         break
+                if var_codes is None and name_y > 650 and pg_num + 1 in tables_by_pg_num:
+                    for _, table_info in tables_by_pg_num[pg_num+1].items():
+                        if is_table_almost_first_thing_on_page(table_info['raw_table']):
+                            var_codes = table_info['parsed']
 
-                    var_codes = parsed
-                    del ycoords_tables[table_y]
-                    break
-            if var_codes is None and name_y > 650 and pg_num + 1 in tables_by_pg_num:
-                for _, table_info in tables_by_pg_num[pg_num+1].items():
-                    if is_table_almost_first_thing_on_page(table_info['raw_table']):
-                        var_codes = table_info['parsed']
-
-            name_to_table[name]['table'] = var_codes
-            name_to_table[name]['location'] = f'{str(pg_num).zfill(4)}{str(round(name_y)).zfill(4)}'
+                name_to_table[name]['table'] = var_codes
+                name_to_table[name]['page'] = pg_num
+                name_to_table[name]['location'] = f'{str(pg_num).zfill(4)}{str(round(name_y)).zfill(4)}'
 
-    return name_to_table
+        return name_to_table
 
 def parse_table_cells(table):
     """
@@ -256,7 +482,7 @@ def parse_table_cells(table):
 def is_table_first_thing_on_page(table):
     """
     helper method
-    takes pdf plumber table object
+    takes pdf plumber table object (or TableOutline)
     checks whether distance from table to top of page is less than 75
     """
     dist_to_top = table.bbox[1]
@@ -265,7 +491,7 @@ def is_table_first_thing_on_page(table):
 def is_table_last_thing_on_page(table):
     """
     helper method
-    takes pdf plumber table object
+    takes pdf plumber table object (or TableOutline)
     checks whether distance from table to top of page is more than 670
     """
     dist_to_top = table.bbox[3]
@@ -274,7 +500,7 @@ def is_table_last_thing_on_page(table):
 def is_table_almost_first_thing_on_page(table):
     """
     helper method
-    takes pdf plumber table object
+    takes pdf plumber table object (or TableOutline)
     checks whether distance from table to top of page is less than 150
     """
     dist_to_top = table.bbox[1]
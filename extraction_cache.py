@@ -0,0 +1,286 @@
+"""
+extraction_cache.py
+module for caching extraction results (ocr text, tables, variable names, ...) on disk
+NOTE: results are keyed by the PDF's content hash (not its file name) + PIPELINE_VERSION,
+      so a revised manual saved under the same name is always reprocessed
+      per-page results are also keyed by each page's own fingerprint (see hash_pdf_pages),
+      so only the pages that changed in a revised manual are reprocessed
+"""
+
+import hashlib
+import os
+import pickle
+import threading
+import pdfplumber
+from pdfminer.pdftypes import PDFObjRef, PDFStream
+
+CACHE_DIR = 'extraction_cache'
+
+# bump whenever a change to the pipeline changes what gets cached (invalidates all entries)
+PIPELINE_VERSION = 4
+
+# least recently used entries are evicted once the cache grows past this size
+MAX_CACHE_BYTES = 2 * 1024**3
+
+_pdf_hashes = {}
+_page_hashes = {}
+_page_hashes_lock = threading.Lock() # stages running in threads fingerprint pages once
+
+def hash_pdf(pdf_fp):
+    """
+    takes str representing path to PDF
+    returns sha256 hex digest of the PDF's contents
+        (memoized on path, size and modification time so a file is only read once per run)
+    """
+    stat = os.stat(pdf_fp)
+    memo_key = (os.path.abspath(pdf_fp), stat.st_size, stat.st_mtime_ns)
+    if memo_key not in _pdf_hashes:
+        sha = hashlib.sha256()
+        with open(pdf_fp, 'rb') as f:
+            for chunk in iter(lambda: f.read(1024*1024), b''):
+                sha.update(chunk)
+        _pdf_hashes[memo_key] = sha.hexdigest()
+
+    return _pdf_hashes[memo_key]
+
+def hash_pdf_obj(obj, digests):
+    """
+    takes pdfminer object (dict, list, stream, reference, ...) and dict memoizing digests of
+    indirect objects by id (so objects shared by pages, e.g. fonts, are only hashed once)
+    returns sha256 digest (bytes) of object and everything it references
+        'Parent'/'P' (back references up the page tree) are not followed
+        streams are hashed as stored (encoded), so the object has to come from a document
+        nothing was parsed from (pdfminer drops a stream's raw data once it decodes it)
+    """
+    if isinstance(obj, PDFObjRef):
+        if obj.objid not in digests:
+            digests[obj.objid] = b'cycle' # in case object (indirectly) references itself
+            digests[obj.objid] = hash_pdf_obj(obj.resolve(), digests)
+        return digests[obj.objid]
+
+    sha = hashlib.sha256()
+    match obj:
+        case PDFStream():
+            attrs = {key: value for key, value in obj.attrs.items() if key != 'Length'}
+            sha.update(b'stream')
+            sha.update(hash_pdf_obj(attrs, digests))
+            sha.update(obj.get_rawdata())
+        case dict():
+            sha.update(b'dict')
+            for key in sorted(obj):
+                if key in ('Parent', 'P'):
+                    continue
+                sha.update(repr(key).encode())
+                sha.update(hash_pdf_obj(obj[key], digests))
+        case list() | tuple():
+            sha.update(b'list')
+            for item in obj:
+                sha.update(hash_pdf_obj(item, digests))
+        case _:
+            sha.update(repr(obj).encode())
+
+    return sha.digest()
+
+def hash_pdf_pages(pdf_fp):
+    """
+    takes str representing path to PDF
+    returns list of fingerprints (sha256 hex digests), one per page
+        each covers everything the page is drawn from: content streams, resources
+        (fonts, images, ...), annotations and page boxes/rotation
+        a page that is unchanged in a revised PDF keeps its fingerprint
+        (memoized on path, size and modification time so a file is only read once per run)
+    the PDF is opened on its own for this, not shared with the document session, whose pages
+        (and the fonts they share) may already be parsed
+    """
+    stat = os.stat(pdf_fp)
+    memo_key = (os.path.abspath(pdf_fp), stat.st_size, stat.st_mtime_ns)
+    with _page_hashes_lock:
+        if memo_key in _page_hashes:
+            return _page_hashes[memo_key]
+
+        digests = {}
+        fingerprints = []
+        with pdfplumber.open(pdf_fp) as pdf:
+            for page in pdf.pages:
+                page_obj = page.page_obj
+                page_parts = [page_obj.contents, page_obj.resources, page_obj.attrs.get('Annots'),
+                              page_obj.mediabox, page_obj.cropbox, page_obj.rotate]
+                fingerprints.append(hash_pdf_obj(page_parts, digests).hex())
+        _page_hashes[memo_key] = fingerprints
+
+    return fingerprints
+
+def get_cache_fp(pdf_fp, stage):
+    """
+    takes str representing path to PDF and str naming the cached stage (e.g. 'ocr_text')
+    returns path of the cache entry for that PDF content, stage and pipeline version
+    """
+    return os.path.join(CACHE_DIR, f'{hash_pdf(pdf_fp)}_{stage}_v{PIPELINE_VERSION}.pkl')
+
+def get_page_cache_fp(page_key, stage):
+    """
+    takes str fingerprint of a page (see hash_pdf_pages) and str naming the cached stage
+    returns path of the cache entry for that page content, stage and pipeline version
+    """
+    return os.path.join(CACHE_DIR, f'page_{page_key}_{stage}_v{PIPELINE_VERSION}.pkl')
+
+def read_cache_entry(cache_fp):
+    """
+    takes str representing path of cache entry
+    returns tuple (found, result)
+        - found: bool, whether entry exists (and is readable)
+        - result: stored result (None if not found)
+    """
+    if not os.path.isfile(cache_fp):
+        return False, None
+
+    try:
+        with open(cache_fp, 'rb') as f:
+            result = pickle.load(f)
+    except (OSError, EOFError, pickle.UnpicklingError):
+        return False, None # unreadable entry, treated as missing
+
+    os.utime(cache_fp) # mark as recently used
+    return True, result
+
+def write_cache_entry(cache_fp, result):
+    """
+    takes str representing path of cache entry and result to store there
+    """
+    os.makedirs(CACHE_DIR, exist_ok=True)
+
+    # write then rename so concurrent runs never read a half written entry
+    tmp_fp = f'{cache_fp}.{os.getpid()}.tmp'
+    with open(tmp_fp, 'wb') as f:
+        pickle.dump(result, f)
+    os.replace(tmp_fp, cache_fp)
+
+def load_cached(pdf_fp, stage):
+    """
+    takes str representing path to PDF and str naming the stage
+    returns tuple (found, result)
+        - found: bool, whether a result of stage is stored for this PDF's content
+        - result: stored result (None if not found)
+    """
+    return read_cache_entry(get_cache_fp(pdf_fp, stage))
+
+def store_cached(pdf_fp, stage, result):
+    """
+    takes str representing path to PDF, str naming the stage and result of stage
+    stores result for this PDF's content, then evicts old entries if cache is too big
+    """
+    write_cache_entry(get_cache_fp(pdf_fp, stage), result)
+    evict_cache()
+
+def load_page_cached(page_key, stage):
+    """
+    takes str fingerprint of a page (see hash_pdf_pages) and str naming the stage
+    returns tuple (found, result), see load_cached
+    """
+    return read_cache_entry(get_page_cache_fp(page_key, stage))
+
+def store_page_cached(page_key, stage, result):
+    """
+    takes str fingerprint of a page (see hash_pdf_pages), str naming the stage and result
+    stores result for this page's content
+    NOTE: does not evict, call evict_cache once done storing a document's pages
+    """
+    write_cache_entry(get_page_cache_fp(page_key, stage), result)
+
+def cached(pdf_fp, stage, compute, regen=False, keep=None):
+    """
+    takes str representing path to PDF, str naming the stage and a function with no inputs
+    returns stored result of stage for this PDF's content if there is one
+        else (or if regen) returns compute() and stores it
+    keep: optional function taking the result, returning whether to store it
+        (e.g. not if a page went over its time budget, see page_budgets.py)
+    """
+    if not regen:
+        found, result = load_cached(pdf_fp, stage)
+        if found:
+            return result
+
+    result = compute()
+    if keep is None or keep(result):
+        store_cached(pdf_fp, stage, result)
+
+    return result
+
+def iter_cached_pages(pdf_fp, stage, compute_pages, page_variants=None, regen=False, keep=None):
+    """
+    generator, takes:
+        - str representing path to PDF
+        - str naming the stage
+        - function taking list of page numbers, returning iterable of results of stage for
+          those pages (in order)
+        - page_variants: optional list with, for each page, anything else its result depends
+          on besides the page's content (e.g. regions read), part of the page's cache key
+        - keep: optional function taking a page's result, returning whether to store it
+    yields result of stage for each page of PDF in page order
+        stored results are reused for pages whose content is unchanged (unless regen),
+        compute_pages is only given the pages with no stored result
+    """
+    page_keys = hash_pdf_pages(pdf_fp)
+    if page_variants is not None:
+        page_keys = [hashlib.sha256(f'{page_key}{variant!r}'.encode()).hexdigest()
+                     for page_key, variant in zip(page_keys, page_variants)]
+
+    # stored results are only loaded when their page comes up (one page in memory at a time)
+    stored_pg_nums = set()
+    if not regen:
+        stored_pg_nums = {pg_num for pg_num, page_key in enumerate(page_keys)
+                          if os.path.isfile(get_page_cache_fp(page_key, stage))}
+    missing_pg_nums = [pg_num for pg_num in range(len(page_keys)) if pg_num not in stored_pg_nums]
+    if stored_pg_nums:
+        print(f'{len(stored_pg_nums)} pages reused from extraction cache, '
+              f'{len(missing_pg_nums)} to read...')
+
+    computed = iter(compute_pages(missing_pg_nums)) if missing_pg_nums else iter(())
+    for pg_num, page_key in enumerate(page_keys):
+        if pg_num in stored_pg_nums:
+            found, result = load_page_cached(page_key, stage)
+            if found:
+                yield result
+                continue
+            # entry evicted (e.g. by another run) since it was found
+            result = next(iter(compute_pages([pg_num])))
+        else:
+            result = next(computed)
+        if keep is None or keep(result):
+            store_page_cached(page_key, stage, result)
+        yield result
+
+    evict_cache()
+
+def evict_cache(max_bytes=MAX_CACHE_BYTES):
+    """
+    deletes least recently used cache entries until the cache takes up at most max_bytes
+    """
+    if not os.path.isdir(CACHE_DIR):
+        return
+
+    entries = []
+    for file in os.listdir(CACHE_DIR):
+        if not file.endswith('.pkl'):
+            continue
+        try:
+            stat = os.stat(os.path.join(CACHE_DIR, file))
+        except FileNotFoundError:
+            continue # evicted by another run (or stage) since it was listed
+        entries.append((stat.st_mtime, stat.st_size, file))
+
+    total = sum(size for _, size, _ in entries)
+    for _, size, file in sorted(entries):
+        if total <= max_bytes:
+            break
+        try:
+            os.remove(os.path.join(CACHE_DIR, file))
+        except FileNotFoundError:
+            pass # already evicted by another run
+        total -= size
+
+def clear_cache():
+    """
+    deletes every cache entry
+    """
+    evict_cache(max_bytes=0)
@@ -0,0 +1,346 @@
+"""
+extraction_service.py
+script to run a long-lived local extraction service (http on localhost)
+keeps a pool of pre-warmed worker processes (cv2, pymupdf, pytesseract, pandas and pdfplumber
+already imported) so jobs do not pay the startup cost, manuals are processed with the same
+pipelines as batch_process.py (see process_manual)
+endpoints (json in/out):
+    - POST /jobs           {"pdf": path, "format": "auto", "text_source": "ocr",
+                            "output_formats": ["xlsx"], "word_backend": "pdfplumber",
+                            "page_seconds": null, "document_seconds": null},
+                           add ?wait=1 to reply once finished
+    - GET  /jobs           all jobs
+    - GET  /jobs/<id>      status of one job (queued, running, ok or failed) and its manifest entry
+    - GET  /metrics        queue depth, running/finished counts and timings
+NOTE: jobs are kept in memory only, they are lost when the service stops
+      paths are resolved by the service, so use absolute paths (or paths relative to where it runs)
+"""
+
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from urllib.parse import urlsplit, parse_qs
+from fhs_utility.misc import date_ext
+from batch_process import process_manual
+from document_session import WORKER_MP_CONTEXT
+from output_writers import check_output_formats
+from page_budgets import DEFAULT_PAGE_SECONDS, BudgetExceeded
+from word_backends import DEFAULT_WORD_BACKEND, check_word_backend
+
+MANUAL_FORMATS = ['auto', 'current', 'old']
+TEXT_SOURCES = ['ocr', 'hybrid', 'regions']
+
+HTTP_REASONS = {200: 'OK', 202: 'Accepted', 400: 'Bad Request', 404: 'Not Found',
+                405: 'Method Not Allowed', 503: 'Service Unavailable'}
+
+def warm_worker():
+    """
+    runs once in every worker process, imports the pipelines (and their heavy dependencies)
+    so the first job a worker gets does not pay for them
+    """
+    import old_format_cmanual_pdf_to_data_dict
+    try:
+        import cmanual_pdf_to_data_dict
+        import cv2, numpy # imported by the pipeline on first ocr, see get_pytesseract
+        cmanual_pdf_to_data_dict.get_pytesseract()
+    except ImportError:
+        pass # current format dependencies not installed, old format manuals still work
+
+def get_worker_pid():
+    """
+    returns pid of worker process it runs in (used to start every worker up front)
+    """
+    time.sleep(0.1) # keeps worker busy so each call gets its own process
+    return os.getpid()
+
+def parse_job_request(body):
+    """
+    takes dict posted to /jobs
+    returns dict of process_manual keyword args
+    raises ValueError if request is not valid
+    """
+    if not isinstance(body, dict):
+        raise ValueError(f'expected a json object, got: {body}')
+
+    pdf_fp = body.get('pdf')
+    if not isinstance(pdf_fp, str) or not os.path.isfile(pdf_fp):
+        raise ValueError(f'pdf not found: {pdf_fp}')
+
+    manual_format = body.get('format', 'auto')
+    if not isinstance(manual_format, str) or manual_format not in MANUAL_FORMATS:
+        raise ValueError(f'unknown manual format: {manual_format} '
+                         f'(expected one of {', '.join(MANUAL_FORMATS)})')
+
+    text_source = body.get('text_source', 'ocr')
+    if not isinstance(text_source, str) or text_source not in TEXT_SOURCES:
+        raise ValueError(f'unknown text source: {text_source} '
+                         f'(expected one of {', '.join(TEXT_SOURCES)})')
+
+    output_formats = body.get('output_formats', ['xlsx'])
+    if isinstance(output_formats, str):
+        output_formats = [output_formats]
+    if (not isinstance(output_formats, list) or
+        not all(isinstance(output_format, str) for output_format in output_formats)):
+        raise ValueError(f'output_formats must be a format or list of formats: {output_formats}')
+    try:
+        check_output_formats(output_formats)
+    except ImportError as e:
+        raise ValueError(str(e))
+
+    word_backend = body.get('word_backend', DEFAULT_WORD_BACKEND)
+    if not isinstance(word_backend, str):
+        raise ValueError(f'word_backend must be a backend name: {word_backend}')
+    check_word_backend(word_backend)
+
+    budgets = {'page_seconds': body.get('page_seconds', DEFAULT_PAGE_SECONDS),
+               'document_seconds': body.get('document_seconds')}
+    for name, seconds in budgets.items():
+        if seconds is not None and (isinstance(seconds, bool) or
+                                    not isinstance(seconds, (int, float)) or seconds <= 0):
+            raise ValueError(f'{name} must be a positive number of seconds or null: {seconds}')
+
+    return {'pdf_fp': pdf_fp,
+            'manual_format': manual_format,
+            'text_source': text_source,
+            'output_formats': tuple(output_formats),
+            'word_backend': word_backend,
+            **budgets}
+
+class ExtractionService:
+    """
+    Class to hold the job queue and worker pool of a running service
+    Fields:
+        - workers: int, number of jobs processed at once
+        - max_queued: int, number of waiting jobs after which new jobs are turned away
+        - jobs: dict, job id -> job (dict with 'id', 'status', 'request', 'entry', timestamps)
+        - queue: asyncio.Queue of job ids waiting for a worker
+    """
+    def __init__(self, workers=1, max_queued=100):
+        self.workers = workers
+        self.max_queued = max_queued
+        self.jobs = {}
+        self.queue = asyncio.Queue()
+        self.job_ids = itertools.count(1)
+        self.done_events = {}
+        self.executor = None
+        self.consumers = []
+        self.started = time.time()
+
+    async def start(self):
+        """
+        starts worker processes (warmed up before returning) and the tasks feeding them jobs
+        """
+        loop = asyncio.get_running_loop()
+        self.executor = ProcessPoolExecutor(max_workers=self.workers, mp_context=WORKER_MP_CONTEXT,
+                                            initializer=warm_worker)
+        start = time.perf_counter()
+        pids = await asyncio.gather(*(loop.run_in_executor(self.executor, get_worker_pid)
+                                      for _ in range(self.workers)))
+        print(f'{len(set(pids))} workers warmed up in {time.perf_counter() - start:.1f}s')
+
+        self.consumers = [asyncio.create_task(self.consume()) for _ in range(self.workers)]
+
+    async def stop(self):
+        """
+        stops feeding jobs, cancels queued ones and shuts worker processes down
+        """
+        for consumer in self.consumers:
+            consumer.cancel()
+        await asyncio.gather(*self.consumers, return_exceptions=True)
+        self.executor.shutdown(wait=True, cancel_futures=True)
+
+    def submit(self, request):
+        """
+        takes dict of process_manual keyword args (see parse_job_request)
+        returns new job (dict), queued for a worker
+        """
+        job_id = str(next(self.job_ids))
+        job = {'id': job_id,
+               'status': 'queued',
+               'request': request,
+               'entry': None,
+               'submitted': date_ext(full=True),
+               'queued_seconds': None,
+               'submitted_at': time.perf_counter()}
+        self.jobs[job_id] = job
+        self.done_events[job_id] = asyncio.Event()
+        self.queue.put_nowait(job_id)
+
+        return job
+
+    async def wait(self, job_id):
+        """
+        returns job once it has finished
+        """
+        await self.done_events[job_id].wait()
+        return self.jobs[job_id]
+
+    async def consume(self):
+        """
+        takes queued jobs one at a time and runs them in the worker pool (one consumer per worker)
+        """
+        loop = asyncio.get_running_loop()
+        while True:
+            job_id = await self.queue.get()
+            job = self.jobs[job_id]
+            job['status'] = 'running'
+            job['queued_seconds'] = round(time.perf_counter() - job['submitted_at'], 3)
+            request = job['request']
+            executor = self.executor
+            try:
+                job['entry'] = await loop.run_in_executor(
+                    executor, process_manual, request['pdf_fp'], request['manual_format'],
+                    request['text_source'], request['output_formats'], request['word_backend'],
+                    request['page_seconds'], request['document_seconds'])
+                job['status'] = job['entry']['status']
+                if job['entry']['output'] is not None: # relative to where the service runs
+                    job['entry']['output'] = os.path.abspath(job['entry']['output'])
+            except (Exception, BudgetExceeded) as e:
+                # worker itself died (e.g. killed for memory), not caught by process_manual
+                job['status'] = 'failed'
+                job['entry'] = {'pdf': request['pdf_fp'], 'error': f'{type(e).__name__}: {e}'}
+                if isinstance(e, BrokenProcessPool) and executor is self.executor:
+                    # pool cannot take more jobs once a worker dies, start a fresh one
+                    self.executor = ProcessPoolExecutor(max_workers=self.workers,
+                                                        mp_context=WORKER_MP_CONTEXT,
+                                                        initializer=warm_worker)
+                    executor.shutdown(wait=False, cancel_futures=True)
+            finally:
+                self.done_events[job_id].set()
+                self.queue.task_done()
+
+    def job_info(self, job):
+        """
+        returns json-friendly view of job
+        """
+        return {key: value for key, value in job.items() if key != 'submitted_at'}
+
+    def metrics(self):
+        """
+        returns dict of queue depth, job counts by status and job timings
+        """
+        statuses = [job['status'] for job in self.jobs.values()]
+        finished = [job['entry']['seconds'] for job in self.jobs.values()
+                    if job['status'] in ('ok', 'failed') and job['entry'].get('seconds') is not None]
+        queued = [job['queued_seconds'] for job in self.jobs.values()
+                  if job['queued_seconds'] is not None]
+
+        return {'workers': self.workers,
+                'uptime_seconds': round(time.time() - self.started, 1),
+                'queue_depth': self.queue.qsize(),
+                'max_queued': self.max_queued,
+                'jobs_submitted': len(statuses),
+                'jobs_queued': statuses.count('queued'),
+                'jobs_running': statuses.count('running'),
+                'jobs_ok': statuses.count('ok'),
+                'jobs_failed': statuses.count('failed'),
+                'mean_job_seconds': round(sum(finished) / len(finished), 3) if finished else None,
+                'max_job_seconds': max(finished, default=None),
+                'mean_queued_seconds': round(sum(queued) / len(queued), 3) if queued else None}
+
+    async def route(self, method, target, body):
+        """
+        takes http method, request target (path + query) and request body (bytes)
+        returns tuple (http status, json-friendly response)
+        """
+        url = urlsplit(target)
+        query = parse_qs(url.query)
+        parts = [part for part in url.path.split('/') if part]
+
+        match method, parts:
+            case 'GET', ['metrics']:
+                return 200, self.metrics()
+            case 'GET', ['jobs']:
+                return 200, [self.job_info(job) for job in self.jobs.values()]
+            case 'GET', ['jobs', job_id]:
+                if job_id not in self.jobs:
+                    return 404, {'error': f'no job {job_id}'}
+                return 200, self.job_info(self.jobs[job_id])
+            case 'POST', ['jobs']:
+                try:
+                    request = parse_job_request(json.loads(body or b'{}'))
+                except ValueError as e: # json errors are ValueErrors too
+                    return 400, {'error': str(e)}
+                if self.queue.qsize() >= self.max_queued:
+                    return 503, {'error': f'queue full ({self.max_queued} jobs waiting)'}
+                job = self.submit(request)
+                if query.get('wait', ['0'])[0] not in ('0', 'false'):
+                    return 200, self.job_info(await self.wait(job['id']))
+                return 202, self.job_info(job)
+            case _, ['metrics'] | ['jobs'] | ['jobs', _]:
+                return 405, {'error': f'{method} not allowed on {url.path}'}
+            case _:
+                return 404, {'error': f'not found: {url.path}'}
+
+    async def handle(self, reader, writer):
+        """
+        answers one http request per connection
+        """
+        try:
+            request_line = (await reader.readline()).decode('latin-1').split()
+            headers = {}
+            while (line := await reader.readline()) not in (b'\r\n', b'\n', b''):
+                name, _, value = line.decode('latin-1').partition(':')
+                headers[name.strip().lower()] = value.strip()
+            content_length = headers.get('content-length', '0')
+
+            # body is not read if its length is unknown (nothing else is read from connection)
+            if not (content_length.isascii() and content_length.isdigit()):
+                status, response = 400, {'error': 'bad Content-Length'}
+            elif len(request_line) < 2:
+                status, response = 400, {'error': 'malformed request'}
+            else:
+                body = await reader.readexactly(int(content_length))
+                status, response = await self.route(request_line[0].upper(), request_line[1], body)
+
+            payload = json.dumps(response, indent=2).encode('utf-8')
+            writer.write(f'HTTP/1.1 {status} {HTTP_REASONS[status]}\r\n'
+                         f'Content-Type: application/json\r\n'
+                         f'Content-Length: {len(payload)}\r\n'
+                         f'Connection: close\r\n\r\n'.encode('latin-1') + payload)
+            await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass # client went away
+        finally:
+            writer.close()
+
+async def serve(host='127.0.0.1', port=8765, workers=1, max_queued=100):
+    """
+    runs extraction service until interrupted
+    """
+    service = ExtractionService(workers=workers, max_queued=max_queued)
+    await service.start()
+    server = await asyncio.start_server(service.handle, host, port)
+    print(f'Extraction service listening on http://{host}:{port} ({workers} workers)')
+    try:
+        async with server:
+            await server.serve_forever()
+    finally:
+        await service.stop()
+
+def main():
+    """
+    command line entry point, see --help
+    """
+    parser = argparse.ArgumentParser(description='Run a local extraction service that processes '
+                                                 'coding manual PDFs with pre-warmed workers.')
+    parser.add_argument('--host', default='127.0.0.1', help='address to listen on (default: localhost)')
+    parser.add_argument('--port', type=int, default=8765, help='port to listen on (default: 8765)')
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1,
+                        help='number of manuals processed at once (default: number of CPUs)')
+    parser.add_argument('--max-queued', type=int, default=100,
+                        help='number of waiting jobs after which new jobs are turned away')
+    args = parser.parse_args()
+
+    try:
+        asyncio.run(serve(args.host, args.port, args.workers, args.max_queued))
+    except KeyboardInterrupt:
+        print('Extraction service stopped')
+
+if __name__ == '__main__':
+    main()
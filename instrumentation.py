@@ -0,0 +1,213 @@
+"""
+instrumentation.py
+module for timing spans and counters around pipeline stages, exported as a chrome trace
+(load in chrome://tracing or https://ui.perfetto.dev)
+NOTE: disabled unless enable() is called, span() and count() then do (almost) nothing
+      worker processes started after enable() record too, their events are collected
+      through files in a temporary trace directory
+      get_peak_rss_mb reports peak memory of the process (independent of enable())
+      spans of stages running in threads are recorded with their thread id (own row in trace)
+"""
+
+import json
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager, nullcontext
+
+try:
+    import resource # peak memory, not available on Windows
+except ImportError:
+    resource = None
+
+# set by enable(), inherited by worker processes
+TRACE_DIR_ENV = 'CMANUAL_TRACE_DIR'
+TRACE_PID_ENV = 'CMANUAL_TRACE_PID'
+
+NULL_SPAN = nullcontext()
+
+_trace_dir = os.environ.get(TRACE_DIR_ENV)
+_main_pid = int(os.environ.get(TRACE_PID_ENV, 0))
+_events = []
+_counters = defaultdict(int)
+_buffer_pid = os.getpid() # process _events/_counters belong to (forked workers start empty)
+_local = threading.local() # depth: number of spans open in thread
+
+def enable():
+    """
+    starts recording spans and counters (in this process and workers started from now on)
+    """
+    global _trace_dir, _main_pid
+    if _trace_dir is None:
+        _trace_dir = tempfile.mkdtemp(prefix='cmanual_trace_')
+        _main_pid = os.getpid()
+        os.environ[TRACE_DIR_ENV] = _trace_dir
+        os.environ[TRACE_PID_ENV] = str(_main_pid)
+
+def disable():
+    """
+    stops recording and drops everything recorded so far
+    """
+    global _trace_dir
+    if _trace_dir is not None and os.getpid() == _main_pid:
+        shutil.rmtree(_trace_dir, ignore_errors=True)
+        os.environ.pop(TRACE_DIR_ENV, None)
+        os.environ.pop(TRACE_PID_ENV, None)
+    _trace_dir = None
+    _events.clear()
+    _counters.clear()
+
+def is_enabled():
+    """
+    returns whether spans and counters are being recorded
+    """
+    return _trace_dir is not None
+
+def check_buffer_pid():
+    """
+    empties events/counters copied from the parent process into a forked worker
+    """
+    global _buffer_pid
+    if _buffer_pid != os.getpid():
+        _events.clear()
+        _counters.clear()
+        _buffer_pid = os.getpid()
+        _local.depth = 0
+
+def span(name, **args):
+    """
+    takes str naming the span and keyword args to attach to it (e.g. page=3)
+    returns context manager timing the code run inside it
+        usage: with span('ocr', page=page_num): ...
+    """
+    if _trace_dir is None:
+        return NULL_SPAN
+    return record_span(name, args)
+
+@contextmanager
+def record_span(name, args):
+    """
+    does the work of span when enabled
+    """
+    check_buffer_pid()
+    _local.depth = getattr(_local, 'depth', 0) + 1
+    start = time.perf_counter_ns()
+    try:
+        yield
+    finally:
+        end = time.perf_counter_ns()
+        _local.depth -= 1
+        _events.append({'name': name,
+                        'ph': 'X',
+                        'ts': start / 1000,
+                        'dur': (end - start) / 1000,
+                        'pid': os.getpid(),
+                        'tid': threading.get_ident(),
+                        'args': args})
+        if _local.depth == 0 and os.getpid() != _main_pid:
+            flush_worker_events()
+
+def count(name, n=1):
+    """
+    takes str naming a counter (e.g. 'pages') and amount to add to it
+    """
+    if _trace_dir is None:
+        return
+    check_buffer_pid()
+    _counters[name] += n
+    if getattr(_local, 'depth', 0) == 0 and os.getpid() != _main_pid:
+        flush_worker_events()
+
+def flush_worker_events():
+    """
+    appends events/counters recorded in this worker process to its file in the trace directory
+        (only what was recorded before the call is removed, other threads may still be adding)
+    """
+    events = _events[:]
+    del _events[:len(events)]
+    counters = {name: _counters.pop(name) for name in list(_counters)}
+    lines = [json.dumps(event) for event in events]
+    if counters:
+        lines.append(json.dumps({'counters': counters}))
+    # one write, so lines of threads flushing at the same time do not interleave
+    with open(os.path.join(_trace_dir, f'events_{os.getpid()}.jsonl'), 'a', encoding='utf-8') as f:
+        f.write(''.join(f'{line}\n' for line in lines))
+
+def collect():
+    """
+    returns tuple (events, counters) recorded so far, in this process and its workers
+    """
+    events = list(_events)
+    counters = defaultdict(int, _counters)
+    if _trace_dir is not None and os.path.isdir(_trace_dir):
+        for file in sorted(os.listdir(_trace_dir)):
+            with open(os.path.join(_trace_dir, file), encoding='utf-8') as f:
+                for line in f:
+                    event = json.loads(line)
+                    if 'counters' in event:
+                        for name, n in event['counters'].items():
+                            counters[name] += n
+                    else:
+                        events.append(event)
+
+    events.sort(key=lambda event: event['ts'])
+    return events, dict(counters)
+
+def summarize(events):
+    """
+    takes list of events (see collect)
+    returns dict
+        - keys: span names
+        - values: dict with 'count', 'total_ms' and 'max_ms' of spans with that name
+    """
+    summary = {}
+    for event in events:
+        stats = summary.setdefault(event['name'], {'count': 0, 'total_ms': 0.0, 'max_ms': 0.0})
+        stats['count'] += 1
+        stats['total_ms'] += event['dur'] / 1000
+        stats['max_ms'] = max(stats['max_ms'], event['dur'] / 1000)
+
+    return {name: {'count': stats['count'],
+                   'total_ms': round(stats['total_ms'], 3),
+                   'max_ms': round(stats['max_ms'], 3)}
+            for name, stats in sorted(summary.items(), key=lambda item: -item[1]['total_ms'])}
+
+def get_peak_rss_mb():
+    """
+    returns peak resident memory of this process so far in MB (None if it cannot be measured)
+    """
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(peak / (1024**2 if sys.platform == 'darwin' else 1024), 1) # bytes on macOS
+
+def write_trace(trace_fp):
+    """
+    takes str representing path of json file to write
+    writes everything recorded so far as a chrome trace-event file
+        - 'traceEvents': spans, plus final counter values (chrome 'C' events)
+        - 'summary': per span name count/total/max (see summarize)
+        - 'counters': final counter values
+    returns summary
+    """
+    events, counters = collect()
+    summary = summarize(events)
+
+    end_ts = max((event['ts'] + event['dur'] for event in events), default=0)
+    counter_events = [{'name': name, 'ph': 'C', 'ts': end_ts, 'pid': _main_pid or os.getpid(),
+                       'args': {name: n}} for name, n in sorted(counters.items())]
+
+    trace_dir = os.path.dirname(trace_fp)
+    if trace_dir:
+        os.makedirs(trace_dir, exist_ok=True)
+    with open(trace_fp, 'w', encoding='utf-8') as f:
+        json.dump({'traceEvents': events + counter_events,
+                   'displayTimeUnit': 'ms',
+                   'summary': summary,
+                   'counters': counters}, f)
+
+    return summary
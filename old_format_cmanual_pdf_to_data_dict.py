@@ -4,11 +4,17 @@ script to read coding manual PDFs, parse info, and create xlsx summary
 NOTE: intended for coding manuals in the old format
 """
 
+from bisect import bisect_left, bisect_right
 from collections import defaultdict
+from functools import cache
 import os
 import re
-import pdfplumber
-from cmanual_pdf_to_data_dict import Variable, write_variables_to_xlsx
+from variable import Variable
+from document_session import document_session
+from word_backends import DEFAULT_WORD_BACKEND, get_backend_stage
+from extraction_cache import hash_pdf_pages, load_page_cached, store_page_cached, evict_cache
+from instrumentation import span, count, get_peak_rss_mb
+from output_writers import check_output_formats, write_variables
 
 def get_var_names_x_coord():
     """
@@ -42,17 +48,17 @@ def is_var_name(s):
         or (':' in s) or ('+' in s) or ('=' in s) or (',' in s) or ('/' in s) or ('.' in s)
         or ('(' in s) or (')' in s) or ('-' in s) or ('"' in s) or ('“' in s) or ('*' in s))
 
-def read_words_and_locations_on_page(pdf, pg_num):
+def read_words_and_locations_on_page(session, pg_num):
     """
-    :input pdf: pdfplumber pdf object
+    :input session: document session (see document_session.py)
     :input pg_num: int, 0 <= pg_num < (number of pages in pdf)
 
     returns list of dictionaries
         dict for every word
             dict contains text of words and location information
+    words come from the session's word backend (see word_backends.py)
     """
-    page = pdf.pages[pg_num]
-    words = page.extract_words()
+    words = session.page_words(pg_num)
 
     return [{'text': word['text'],
              'x_start': word['x0'],
@@ -60,6 +66,70 @@ def read_words_and_locations_on_page(pdf, pg_num):
              'y': word['top'],
              'y_bottom': word['bottom']} for word in words]
 
+def index_words_by_y(words):
+    """
+    :input words: output of read_words_and_locations_on_page
+    :output y_index: tuple (ys, order)
+        - order: indices of words sorted by y
+        - ys: y of those words, in same order (for bisect)
+    """
+    order = sorted(range(len(words)), key=lambda i: words[i]['y'])
+    return [words[i]['y'] for i in order], order
+
+def get_page_words(session, pg_num, page_words_cache):
+    """
+    :input session: document session (see document_session.py)
+    :input pg_num: int, 0 <= pg_num < (number of pages in pdf)
+    :input page_words_cache: dict (page number -> ret. value), filled in as pages are read
+    :output: tuple (words, y_index)
+        - words: output of read_words_and_locations_on_page
+        - y_index: output of index_words_by_y for words
+
+    reads (and indexes) the words of each page only once per document
+    the page's parsed objects are released once its words are read (only words are kept)
+    """
+    if pg_num not in page_words_cache:
+        with span('words', page=pg_num):
+            words = read_words_and_locations_on_page(session, pg_num)
+            page_words_cache[pg_num] = (words, index_words_by_y(words))
+            session.release_page(pg_num)
+        count('pages')
+
+    return page_words_cache[pg_num]
+
+def load_stored_page_words(page_keys, word_backend=DEFAULT_WORD_BACKEND):
+    """
+    :input page_keys: list of page fingerprints (see extraction_cache.hash_pdf_pages)
+    :input word_backend: backend the words were read with (see word_backends.py)
+    :output page_words_cache: dict (see get_page_words) with the words of every page
+                              read before (this or a previous version of the document)
+
+    so only new/changed pages of a revised manual have their words extracted again
+    """
+    page_words_cache = {}
+    for pg_num, page_key in enumerate(page_keys):
+        found, words = load_page_cached(page_key, get_backend_stage('page_words', word_backend))
+        if found:
+            page_words_cache[pg_num] = (words, index_words_by_y(words))
+
+    return page_words_cache
+
+def store_page_words(page_keys, page_words_cache, stored_pg_nums,
+                     word_backend=DEFAULT_WORD_BACKEND):
+    """
+    :input page_keys: list of page fingerprints (see extraction_cache.hash_pdf_pages)
+    :input page_words_cache: dict (see get_page_words)
+    :input stored_pg_nums: pages whose words were loaded by load_stored_page_words
+    :input word_backend: backend the words were read with (see word_backends.py)
+
+    stores words of the pages that were read, for reuse by load_stored_page_words
+    """
+    for pg_num, (words, _) in page_words_cache.items():
+        if pg_num not in stored_pg_nums:
+            store_page_cached(page_keys[pg_num], get_backend_stage('page_words', word_backend),
+                              words)
+    evict_cache()
+
 def extract_page_var_names(words, offset=0, is_first_page=False):
     """
     :input words: output of read_words_and_locations_on_page
@@ -83,19 +153,54 @@ def extract_page_var_names(words, offset=0, is_first_page=False):
                 var_names = var_names[i+1:]
                 break
 
-    to_remove = []
-    for var in var_names:
-        if not is_var_name(var['text']):
-            to_remove.append(var)
+    return [var for var in var_names if is_var_name(var['text'])]
 
-    for var in to_remove:
-        var_names.remove(var)
+@cache
+def get_first_page_offsets():
+    """
+    returns list of offsets tried on the first page, in order
+        0, 0.05, 0.1, ... (accumulated by repeatedly adding 0.05, like a scan would)
+        last offset is the first one past 500, used if no offset qualifies
+    """
+    offsets = [0]
+    x = 0
+    while x <= 500:
+        x += 0.05
+        offsets.append(x)
 
-    return var_names
+    return offsets
+
+def find_first_page_offset(words):
+    """
+    :input words: output of read_words_and_locations_on_page for the first page
+    :output offset: first offset in get_first_page_offsets() for which
+                    extract_page_var_names(words, offset, is_first_page=True) has 2 or more names
+                    (last offset if there is none)
 
-def extract_pdf_var_names(pdf):
+    the words crossed by the scan line only change where it enters/leaves a word's x-interval,
+    so instead of trying every offset, only offsets where the crossed words change are tried
     """
-    :input pdf: pdfplumber pdf object
+    offsets = get_first_page_offsets()
+    xs = [get_var_names_x_coord() + offset for offset in offsets]
+
+    # word is crossed at offsets[k] for enter <= k < leave
+    change_points = {0}
+    for word in words:
+        change_points.add(bisect_left(xs, word['x_start']))
+        change_points.add(bisect_right(xs, word['x_end']))
+
+    for k in sorted(change_points):
+        if k >= len(offsets) - 1:
+            break
+        if len(extract_page_var_names(words, offset=offsets[k], is_first_page=True)) >= 2:
+            return offsets[k]
+
+    return offsets[-1]
+
+def extract_pdf_var_names(session, page_words_cache=None):
+    """
+    :input session: document session (see document_session.py)
+    :input page_words_cache: dict shared with extract_var_text (see get_page_words)
     :output var_names_by_page: list of list of dictionaries
         - each inner list represents a page
             - dicts in inner lists are variable names
@@ -103,35 +208,30 @@ def extract_pdf_var_names(pdf):
 
     wrapper method for extract_page_var_names
     on the first page:
-        - tries gradually increasing to the offset param of extract_page_var_names
-            - adds to this value until the ret. value of extract_page_var_names:
-                - has a length of 3 or more
-                - has 'ID' in it (common var. name that appears on first page often)
-                - has 'IDTYPE' in it (common var. name that appears on first page often)
+        - finds the smallest offset param of extract_page_var_names (see find_first_page_offset)
+          for which the ret. value of extract_page_var_names has a length of 2 or more
     iterates through all pages using that offset value
     """
+    if page_words_cache is None:
+        page_words_cache = {}
     var_names_by_page = []
 
     x=0
-    for i in range(len(pdf.pages)):
-        words = read_words_and_locations_on_page(pdf, i)
+    for i in range(session.num_pages):
+        words, _ = get_page_words(session, i, page_words_cache)
         
         if i == 0:
-            while len(extract_page_var_names(words, offset=x, is_first_page=(i==0))) < 2 \
-            and 'IDTYPE' not in extract_page_var_names(words, offset=x, is_first_page=(i==0))\
-            and 'ID' not in extract_page_var_names(words, offset=x, is_first_page=(i==0)):
-                x += 0.05
-                if x > 500:
-                    break
+            x = find_first_page_offset(words)
 
         var_names_by_page.append(extract_page_var_names(words, offset=x, is_first_page=(i==0)))
 
     return var_names_by_page
 
-def extract_var_text(pdf, var_names_by_page):
+def extract_var_text(session, var_names_by_page, page_words_cache=None):
     """
-    :input pdf: pdfplumber pdf object
+    :input session: document session (see document_session.py)
     :input var_names_by_page: output of extract_pdf_var_names
+    :input page_words_cache: dict shared with extract_pdf_var_names (see get_page_words)
     :output name_to_text: dictionary mapping variable name to the text
         corresponding to that variable
 
@@ -139,16 +239,18 @@ def extract_var_text(pdf, var_names_by_page):
     for each variable:
         extracts the text corresponding to that variable
     """
+    if page_words_cache is None:
+        page_words_cache = {}
     name_to_text = {}
 
     for i, page in enumerate(var_names_by_page):
         # get all words on page
-        words = read_words_and_locations_on_page(pdf, i)
+        words, y_index = get_page_words(session, i, page_words_cache)
         
         # get next page words and var names on page if exist
-        next_page_words, next_page_vars = None, None
+        next_page_words, next_y_index, next_page_vars = None, None, None
         if i+1 < len(var_names_by_page):
-            next_page_words = read_words_and_locations_on_page(pdf, i+1)
+            next_page_words, next_y_index = get_page_words(session, i+1, page_words_cache)
             next_page_vars = var_names_by_page[i+1]
         
         # iterate through all vars on current page
@@ -157,41 +259,50 @@ def extract_var_text(pdf, var_names_by_page):
             if j + 1 < len(page):
                 # logic for if variable is not last on page
                 y2 = page[j+1]['y']
-                name_to_text[var['text']] = pull_text_between(y1, y2, words)
+                name_to_text[var['text']] = pull_text_between(y1, y2, words, y_index=y_index)
             else:
                 # logic for if variable is last on page
                 if not next_page_vars:
-                    name_to_text[var['text']] = pull_text_between(y1, 9999, words)
+                    name_to_text[var['text']] = pull_text_between(y1, 9999, words, y_index=y_index)
                 elif len(next_page_vars) > 0:
                     y2 = next_page_vars[0]['y']
-                    name_to_text[var['text']] = handle_broken_var_text(y1, y2, words, next_page_words)
+                    name_to_text[var['text']] = handle_broken_var_text(y1, y2, words, next_page_words,
+                                                                       y_index1=y_index,
+                                                                       y_index2=next_y_index)
                 else:
-                    name_to_text[var['text']] = pull_text_between(y1, 9999, words)
+                    name_to_text[var['text']] = pull_text_between(y1, 9999, words, y_index=y_index)
     return name_to_text
 
-def pull_text_between(y1, y2, words, tolerance=1):
+def pull_text_between(y1, y2, words, tolerance=1, y_index=None):
     """
     pulls text between y1 and y2 in words
+    y_index: output of index_words_by_y for words (built here if not given)
+        words in the y range are found by binary search, then read in their original order
     """
+    if y_index is None:
+        y_index = index_words_by_y(words)
+    ys, order = y_index
+    in_range = order[bisect_left(ys, y1 - tolerance):bisect_left(ys, y2)]
+
     s = ''
     last_y = None
-    for word in words:
-        if (word['y'] >= y1 - tolerance and word['y'] < y2):
-            if last_y is not None:
-                if abs(last_y - word['y_bottom']) > tolerance:
-                    s = s.rstrip()
-                    s += '\n'
-            
-            s += f'{word['text']} '
-            last_y = word['y_bottom']
+    for i in sorted(in_range):
+        word = words[i]
+        if last_y is not None:
+            if abs(last_y - word['y_bottom']) > tolerance:
+                s = s.rstrip()
+                s += '\n'
+
+        s += f'{word['text']} '
+        last_y = word['y_bottom']
 
     return s
 
-def handle_broken_var_text(y1, y2, words1, words2, tolerance=1):
+def handle_broken_var_text(y1, y2, words1, words2, tolerance=1, y_index1=None, y_index2=None):
     """
     handles when var text broken over two pages
     """
-    return f'{pull_text_between(y1, 9999, words1, tolerance=tolerance)}\n{pull_text_between(0, y2, words2, tolerance=tolerance)}'
+    return f'{pull_text_between(y1, 9999, words1, tolerance=tolerance, y_index=y_index1)}\n{pull_text_between(0, y2, words2, tolerance=tolerance, y_index=y_index2)}'
 
 def get_coded_values_patterns():
     """
@@ -200,100 +311,117 @@ def get_coded_values_patterns():
     """
     return [r'\d{1,4}-\d{1,4}[\s=]{1}', r'\d{1,4}[\s=]{1}']
 
-def parse_var_text_for_coded_values(var_text):
+# compiled once, see get_coded_values_patterns
+CODED_VALUE_RANGE_RE, CODED_VALUE_RE = [re.compile(pattern) for pattern in get_coded_values_patterns()]
+DASHES_RE = re.compile(r'[-‐‑‒–—]')
+
+def parse_var_text(var_text):
     """
     :input var_text: any value of extract_var_text output dict
-    :output values: dictionary in format of values param in Variable constructor
-
-    parses variable text for coded values
+    :output: tuple (description, values)
+        - description: str, description of variable
+        - values: dictionary in format of values param in Variable constructor
+
+    parses variable text for description and coded values in one pass over its lines
+        - first line (minus the variable name) starts the description
+        - description continues until the first line that starts with a coded value
+        - every line that starts with a coded value (range or 1-4 digit number) adds a value,
+          following all uppercase lines without a code continue that value's description
     """
-    var_text = re.sub(r'[-‐‑‒–—]', '-', var_text)
-    patterns = get_coded_values_patterns()
+    lines = var_text.split('\n')
+    # coded values are read with all dash variants as '-' (does not change line count)
+    norm_lines = DASHES_RE.sub('-', var_text).split('\n')
 
+    description = ' '.join(lines[0].split(' ')[1:])
+    in_description = True
     values = defaultdict(dict)
     curr_code = None
 
-    lines = var_text.split('\n')[1:]
-    for i, line in enumerate(lines):
-        code = None
-        for pattern in patterns:
-            code = re.search(pattern, line)
-            if code:
-                if code.group().strip() not in line.strip().split(' ')[0]:
-                    continue
-
-                curr_code = code.group().replace('=', '').strip()
-                
-                value_desc = line.replace(code.group(), '').replace('=', '').strip()
-
-                values[curr_code]['Description'] = value_desc
-                values[curr_code]['Count'] = None
-                break
+    for i, (line, norm_line) in enumerate(zip(lines[1:], norm_lines[1:])):
+        # dashes never take part in a match, so searching line or norm_line is the same
+        code = CODED_VALUE_RE.search(line)
+        first_word = norm_line.strip().split(' ')[0]
 
-        if code is None:
-            if i == 0:
-                continue
+        if in_description:
+            if code is not None and code.group() in first_word:
+                in_description = False
             else:
-                if curr_code:
-                    if line.upper() == line and 'Description' in values[curr_code]:
-                        values[curr_code]['Description'] += f' {line.strip()}'
-    
-    return values
+                description += f' {line}'
+
+        match = None
+        if code is not None:
+            range_code = CODED_VALUE_RANGE_RE.search(norm_line) if '-' in norm_line else None
+            for candidate in (range_code, code):
+                if candidate is not None and candidate.group().strip() in first_word:
+                    match = candidate
+                    break
 
-def parse_var_text_for_description(var_text):
+        if match is not None:
+            curr_code = match.group().replace('=', '').strip()
+            values[curr_code]['Description'] = norm_line.replace(match.group(), '').replace('=', '').strip()
+            values[curr_code]['Count'] = None
+        elif code is None and i > 0 and curr_code and norm_line.upper() == norm_line:
+            values[curr_code]['Description'] += f' {norm_line.strip()}'
+
+    return description.replace('=', '').strip(), values
+
+def parse_var_text_for_coded_values(var_text):
     """
     :input var_text: any value of extract_var_text output dict
-    :output values: str, description of variable
+    :output values: dictionary in format of values param in Variable constructor
 
-    parses variable text for description
+    parses variable text for coded values (see parse_var_text)
     """
-    patterns = get_coded_values_patterns()
-    lines = var_text.split('\n')
-    
-    s = ' '.join(lines[0].split(' ')[1:])
-    lines = lines[1:]
+    return parse_var_text(var_text)[1]
 
-    for line in lines:
-        code = None
-        for pattern in patterns:
-            code = re.search(pattern, line)
-        
-        if code is None:
-            s += f' {line}'
-        else:
-            words = line.strip().split(' ')
-            if len(words) <= 0:
-                break
-            elif code.group() in line.strip().split(' ')[0]:
-                break
-            else:
-                s += f' {line}'
+def parse_var_text_for_description(var_text):
+    """
+    :input var_text: any value of extract_var_text output dict
+    :output values: str, description of variable
 
-    return s.replace('=', '').strip()
+    parses variable text for description (see parse_var_text)
+    """
+    return parse_var_text(var_text)[0]
 
-def process_pdf(pdf_fp):
+def process_pdf(pdf_fp, output_formats=('xlsx',), word_backend=DEFAULT_WORD_BACKEND):
     """
     all-in-one method
     takes file path to pdf and uses above functions to produce xlsx data dict
-        - also uses Variable class from cmanual_pdf_to_data_dict.py
+        - output_formats: formats to write it in (see output_writers.OUTPUT_WRITERS)
+        - word_backend: how words are pulled from pages (see word_backends.WORD_BACKENDS)
+        - also uses Variable class from variable.py
+        - words of pages unchanged since a previous run are reused (see load_stored_page_words)
+        - the PDF is opened once, for fingerprints and words (see document_session.py)
+    returns path of written xlsx (of first of output_formats)
     """
+    check_output_formats(output_formats)
     variables = []
-    with pdfplumber.open(pdf_fp) as pdf:
-        var_names =  extract_pdf_var_names(pdf)
-        name_to_text = extract_var_text(pdf, var_names)
-        for var_name, var_text in name_to_text.items():
-            desc = parse_var_text_for_description(var_text)
-            coded_values = parse_var_text_for_coded_values(var_text)
-            variables.append(Variable(var_name, desc, coded_values, None))
-    
-    write_variables_to_xlsx(pdf_fp, variables)
-    print('Done!')
+    with (span('process_pdf', pdf=os.path.basename(pdf_fp), word_backend=word_backend),
+          document_session(pdf_fp, word_backend) as session):
+        page_keys = hash_pdf_pages(pdf_fp)
+        page_words_cache = load_stored_page_words(page_keys, word_backend)
+        stored_pg_nums = set(page_words_cache)
+        with span('extract_pdf_var_names'):
+            var_names =  extract_pdf_var_names(session, page_words_cache)
+        with span('extract_var_text'):
+            name_to_text = extract_var_text(session, var_names, page_words_cache)
+        with span('parse_var_text'):
+            for var_name, var_text in name_to_text.items():
+                desc, coded_values = parse_var_text(var_text)
+                variables.append(Variable(var_name, desc, coded_values, None))
+        count('variables', len(variables))
+        store_page_words(page_keys, page_words_cache, stored_pg_nums, word_backend)
+
+        with span('write outputs'):
+            fp_out = write_variables(pdf_fp, variables, output_formats)[output_formats[0]][0]
+    print(f'Done! (peak memory {get_peak_rss_mb()} MB)')
+    return fp_out
 
 def main():
     """
     main
     """
-    pdf_dir = r'PDFs\old_format'
+    pdf_dir = os.path.join('PDFs', 'old_format')
 
     for file in os.listdir(pdf_dir):
         if '.pdf' not in file.lower():
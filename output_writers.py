@@ -0,0 +1,149 @@
+"""
+output_writers.py
+module for writing data dictionaries (lists of Variable objects) to xlsx, csv, jsonl and parquet
+every format is written from the same rows, built once per extraction (see get_output_frames)
+columnar formats (csv, jsonl, parquet) also get a long-format table of coded values
+    (one row per variable + code) instead of the packed "Coded Values" cell
+NOTE: parquet needs pyarrow (or fastparquet) installed
+"""
+
+import importlib.util
+import os
+import pandas as pd
+from fhs_utility.misc import make_dir, date_ext
+
+XLSX_COLUMNS = ['Variable', 'Description', 'N', 'Miss',
+                'Minimum', 'Maximum', 'Units', 'Coded Values', 'Variable Notes']
+
+CODED_VALUES_COLUMNS = ['Variable', 'Code', 'Description', 'Count']
+
+def get_output_frames(variables):
+    """
+    takes list of Variable objects
+    returns tuple of DataFrames
+        - data dictionary, a row per variable (see Variable.to_row)
+        - coded values, a row per (variable, code): CODED_VALUES_COLUMNS
+    NOTE: Variable.to_row moves notes/units out of description, call this once per extraction
+    """
+    rows = [var.to_row() for var in variables]
+    data_dictionary = pd.DataFrame(rows, columns=XLSX_COLUMNS)
+
+    coded_values = pd.DataFrame([(var.name, code, code_info['Description'], code_info['Count'])
+                                 for var in variables if var.values is not None
+                                 for code, code_info in var.values.items()],
+                                columns=CODED_VALUES_COLUMNS)
+
+    return data_dictionary, coded_values
+
+def to_columnar(data_dictionary):
+    """
+    takes data dictionary DataFrame (see get_output_frames)
+    returns copy with typed numeric columns (blank cells become nulls) for columnar formats
+    """
+    typed = data_dictionary.copy()
+    for column in ['N', 'Miss']:
+        typed[column] = typed[column].replace('', None).astype('Int64')
+    for column in ['Minimum', 'Maximum']:
+        typed[column] = typed[column].replace('', None).astype('Float64')
+
+    return typed
+
+def get_output_fp(output_dir, table, name, extension):
+    """
+    returns path of output file, e.g. output/<date>/Data_Dictionary_<name>.xlsx
+    """
+    return os.path.join(output_dir, f'{table}_{name}.{extension}')
+
+def write_xlsx(output_dir, name, data_dictionary, coded_values):
+    """
+    writes data dictionary to xlsx (coded values stay packed in one cell)
+    returns list of paths written
+    """
+    fp_out = get_output_fp(output_dir, 'Data_Dictionary', name, 'xlsx')
+    with pd.ExcelWriter(fp_out) as writer:
+        writer.book.formats[0].set_text_wrap()
+        data_dictionary.to_excel(writer, sheet_name='Data Dictionary', index=False)
+
+    return [fp_out]
+
+def write_csv(output_dir, name, data_dictionary, coded_values):
+    """
+    writes data dictionary and coded values to csv files
+    returns list of paths written
+    """
+    fps_out = [get_output_fp(output_dir, 'Data_Dictionary', name, 'csv'),
+               get_output_fp(output_dir, 'Coded_Values', name, 'csv')]
+    to_columnar(data_dictionary).to_csv(fps_out[0], index=False)
+    coded_values.to_csv(fps_out[1], index=False)
+
+    return fps_out
+
+def write_jsonl(output_dir, name, data_dictionary, coded_values):
+    """
+    writes data dictionary and coded values to json lines files (an object per row)
+    returns list of paths written
+    """
+    fps_out = [get_output_fp(output_dir, 'Data_Dictionary', name, 'jsonl'),
+               get_output_fp(output_dir, 'Coded_Values', name, 'jsonl')]
+    to_columnar(data_dictionary).to_json(fps_out[0], orient='records', lines=True,
+                                         force_ascii=False)
+    coded_values.to_json(fps_out[1], orient='records', lines=True, force_ascii=False)
+
+    return fps_out
+
+def write_parquet(output_dir, name, data_dictionary, coded_values):
+    """
+    writes data dictionary and coded values to parquet files
+    returns list of paths written
+    """
+    fps_out = [get_output_fp(output_dir, 'Data_Dictionary', name, 'parquet'),
+               get_output_fp(output_dir, 'Coded_Values', name, 'parquet')]
+    to_columnar(data_dictionary).to_parquet(fps_out[0], index=False)
+    coded_values.to_parquet(fps_out[1], index=False)
+
+    return fps_out
+
+# output format -> writer, writers take (output dir, name, data dictionary, coded values)
+OUTPUT_WRITERS = {'xlsx': write_xlsx,
+                  'csv': write_csv,
+                  'jsonl': write_jsonl,
+                  'parquet': write_parquet}
+
+def check_output_formats(output_formats):
+    """
+    takes list of output format names
+    raises ValueError for no or unknown formats, ImportError if parquet is asked for without an engine
+        (call before extraction, so a long run does not fail at the very end)
+    """
+    if not output_formats:
+        raise ValueError('no output format given')
+
+    for output_format in output_formats:
+        if output_format not in OUTPUT_WRITERS:
+            raise ValueError(f'unknown output format: {output_format} '
+                             f'(expected one of {', '.join(OUTPUT_WRITERS)})')
+
+    if 'parquet' in output_formats and not any(importlib.util.find_spec(engine) is not None
+                                               for engine in ('pyarrow', 'fastparquet')):
+        raise ImportError('parquet output needs pyarrow (pip install pyarrow)')
+
+def write_variables(fp, variables, output_formats=('xlsx',)):
+    """
+    takes in str representing fp of PDF, list of variables objects and list of output formats
+        (keys of OUTPUT_WRITERS)
+    writes data dictionary in each format to output/<date>/
+    returns dict
+        - keys: output formats
+        - values: list of paths written (data dictionary first)
+    """
+    check_output_formats(output_formats)
+
+    output_dir = os.path.join('output', date_ext())
+    make_dir(output_dir)
+    name = os.path.split(fp)[-1].replace('.pdf', '')
+
+    data_dictionary, coded_values = get_output_frames(variables)
+
+    return {output_format: OUTPUT_WRITERS[output_format](output_dir, name, data_dictionary,
+                                                         coded_values)
+            for output_format in output_formats}
@@ -0,0 +1,121 @@
+"""
+page_budgets.py
+module for bounding how long one page (and one document) can hold up a run
+a page whose table finding or ocr runs over its budget is retried with a cheaper strategy
+(e.g. lower dpi), and abandoned if that runs over too, either way it is recorded as degraded
+(see run_within_budget and DocumentSession.degraded)
+budgets are off unless asked for (e.g. batch_process.py --page-seconds)
+NOTE: budgets interrupt python code (e.g. pdfplumber's table finder) as soon as they run out,
+      a call into C (pymupdf, cv2) only once it returns, Tesseract is killed (see ocr_image)
+      an interrupt can land anywhere in the code run inside a budget, so only run code that
+      builds its own objects in there (see document_session.find_tables)
+"""
+
+import ctypes
+import threading
+import time
+from contextlib import contextmanager
+
+# seconds one page's table finding / ocr may take before its cheaper strategy is used
+# (None = no limit, normal pages take well under a few seconds)
+DEFAULT_PAGE_SECONDS = None
+
+class BudgetExceeded(BaseException):
+    """
+    raised in code whose time budget ran out
+    (BaseException, like KeyboardInterrupt, so code catching Exception does not swallow it)
+    """
+
+class Budget:
+    """
+    Class to hold the time budgets of a run (picklable, worker processes get the same budgets)
+    Fields:
+        - page_seconds: float, seconds one page's table finding / ocr may take (None = no limit)
+        - deadline: float, time.time() the whole document should be done by (None = no limit)
+    """
+    def __init__(self, page_seconds=DEFAULT_PAGE_SECONDS, document_seconds=None):
+        self.page_seconds = page_seconds
+        self.deadline = time.time() + document_seconds if document_seconds is not None else None
+
+    def seconds_left(self):
+        """
+        returns seconds a page may take now: its page budget, or what is left of the document's
+        budget if that is less (None = no limit)
+        """
+        limits = [self.page_seconds] if self.page_seconds is not None else []
+        if self.deadline is not None:
+            limits.append(max(self.deadline - time.time(), 0.0))
+        return min(limits, default=None)
+
+def interrupt_thread(thread_id):
+    """
+    raises BudgetExceeded in thread (once it runs python code again)
+    """
+    ctypes.pythonapi.PyThreadState_SetAsyncExc(ctypes.c_ulong(thread_id),
+                                               ctypes.py_object(BudgetExceeded))
+
+@contextmanager
+def time_budget(seconds):
+    """
+    takes seconds the code run inside may take (None = no limit)
+    returns context manager raising BudgetExceeded in the code run inside once they have passed
+        usage: with time_budget(60): ...
+    """
+    if seconds is None:
+        yield
+        return
+    if seconds <= 0:
+        raise BudgetExceeded
+
+    thread_id = threading.get_ident()
+    lock = threading.Lock()
+    finished = False
+
+    def interrupt():
+        with lock:
+            if not finished:
+                interrupt_thread(thread_id)
+
+    timer = threading.Timer(seconds, interrupt)
+    timer.daemon = True
+    timer.start()
+    try:
+        yield
+    finally:
+        with lock:
+            finished = True # timer cannot interrupt from here on
+        timer.cancel()
+        # drop an interrupt that came just before the code inside finished (before it was raised)
+        ctypes.pythonapi.PyThreadState_SetAsyncExc(ctypes.c_ulong(thread_id), None)
+
+def run_within_budget(budget, strategies, fallback):
+    """
+    takes:
+        - Budget (None = no limit)
+        - list of (name, function taking the seconds it may take (None = no limit), raising
+          BudgetExceeded once they have passed), from best to cheapest
+        - what to return if every strategy runs over
+    returns tuple
+        - result of the first strategy to finish within budget (fallback if none did)
+        - str describing how the page was degraded (None if first strategy finished in time)
+    every strategy gets a page budget, or what is left of the document budget if that is less
+    (strategies are skipped once the document budget is spent)
+    """
+    if budget is None:
+        return strategies[0][1](None), None
+
+    over = []
+    for name, strategy in strategies:
+        seconds = budget.seconds_left()
+        try:
+            if seconds is not None and seconds <= 0:
+                raise BudgetExceeded # document budget spent
+            result = strategy(seconds)
+        except BudgetExceeded:
+            over.append(name)
+            continue
+        if not over:
+            return result, None
+        return result, f'{', '.join(over)} over budget, used {name}'
+
+    return fallback, f'{', '.join(over)} over budget, abandoned'
@@ -0,0 +1,136 @@
+"""
+variable.py
+module defining the Variable class shared by both coding manual formats
+(kept apart from the pipelines so importing it does not load the ocr/imaging stack)
+"""
+
+import re
+import pandas as pd
+from output_writers import XLSX_COLUMNS
+
+class Variable:
+    """
+    Class to represent a variable parsed from pdf
+    Fields:
+        - name: str
+        - description: str
+        - values: dict (optional, None if not defined)
+            - keys: different values Variable can take on
+            - values:
+                - 'Description': description of what value means (str)
+                - 'Count': count of data that has that value (int) (optional, None if not defined)
+        - pdf_fp: str
+            - file path to pdf variable is in
+        - degraded: list of str (optional), pages variable was read from that went over their
+          time budget and how (see page_budgets.py), noted in its row to be checked by hand
+    """
+    def __init__(self, name, description, values, total_obv, degraded=None):
+        self.name = name
+        self.description = description
+        self.values = values
+        self.total_obv = total_obv
+        self.degraded = degraded or []
+
+    def __str__(self):
+        values_rep = [(val, val_info) for val, val_info in self.values.items()] \
+                     if self.values is not None else None
+        return f'name: {self.name}\ndescription: {self.description}\nvalues: {values_rep}'
+
+    def to_dataframe(self):
+        """
+        converts variable to pandas dataframe for writing to xlsx
+        """
+        return pd.DataFrame([self.to_row()], columns=XLSX_COLUMNS, index=range(1))
+
+    def to_row(self):
+        """
+        converts variable to dict mapping xlsx column name to value (one row of data dictionary)
+        """
+        # N + Miss
+        total = self.total_obv
+        count = 0
+        if self.values is not None and total is not None:
+            for val, val_info in self.values.items():
+                if val_info['Count'] is None:
+                    break
+                else:
+                    count += int(val_info['Count'])
+
+        match count:
+            case 0:
+                count = ''
+
+        if total is not None and count != '':
+            misses = total - count
+        else:
+            misses = ''
+
+        # Minimum + Maximum
+        match self.values:
+            case None:
+                maximum = ''
+                minimum = ''
+            case _:
+                codes = []
+                for code in self.values.keys():
+                    if '–' in code or '—' in code or '-' in code:
+                        code = code.replace('–', '-')
+                        code = code.replace('—', '-')
+                        code = re.sub(r'\s', '', code)
+                        for x in code.split('-'):
+                            try:
+                                float(x)
+                            except:
+                                continue
+                            else:
+                                codes.append(float(x))
+                    else:
+                        try:
+                            float(code)
+                        except:
+                            continue
+                        else:
+                            codes.append(float(code))
+                if len(codes) != 0:
+                    maximum = max(codes)
+                    minimum = min(codes)
+                else:
+                    maximum = ''
+                    minimum = ''
+
+        # Coded Values
+        values_rep = ''
+        match self.values:
+            case None:
+                pass
+            case _:
+                for val, val_info in self.values.items():
+                    s = f'{val} = {val_info['Description']}\r\n'
+                    values_rep += s
+        values_rep = values_rep.rstrip()
+
+        # Variable Notes
+        var_notes = ''
+        if 'Note:' in self.description:
+            var_notes += self.description.split('Note:')[1].strip()
+            self.description = self.description.split('Note:')[0].strip()
+
+        # pages read a cheaper way (or not at all) for time
+        for reason in self.degraded:
+            var_notes = f'{var_notes} !CHECK MANUALLY: {reason}!'.strip()
+
+        # Units
+        units = ''
+        if 'Units:' in self.description:
+            units += self.description.split('Units:')[1].strip()
+            self.description = self.description.split('Units:')[0].strip()
+
+        return {'Variable': self.name,
+                'Description': self.description,
+                'N': count,
+                'Miss': misses,
+                'Minimum': minimum,
+                'Maximum': maximum,
+                'Units': units,
+                'Coded Values': values_rep,
+                'Variable Notes': var_notes}
@@ -0,0 +1,79 @@
+"""
+word_backends.py
+module for pulling words (and their boxes) off PDF pages, with interchangeable backends
+    - 'pdfplumber': page.extract_words() (pure python)
+    - 'pymupdf': page.get_text('words'), many times faster
+every backend returns a list of dicts with 'text', 'x0', 'x1', 'top' and 'bottom' (points from
+the top left of the page) per word, in reading order (lines top to bottom, words left to right)
+NOTE: backends give the same words and boxes on the bundled manuals, except where text is
+      drawn over other text (pdfplumber interleaves the two into one word), see
+      `python benchmark.py words` for parity and throughput
+"""
+
+DEFAULT_WORD_BACKEND = 'pdfplumber'
+
+# words whose tops are this close (chained) are on the same line, as in pdfplumber
+LINE_TOLERANCE = 3
+
+def get_words_pdfplumber(session, pg_num):
+    """
+    takes document session (see document_session.py) and page number
+    returns words on page (see module docstring) from pdfplumber
+    """
+    return [{'text': word['text'],
+             'x0': word['x0'],
+             'x1': word['x1'],
+             'top': word['top'],
+             'bottom': word['bottom']} for word in session.pdf.pages[pg_num].extract_words()]
+
+def get_words_pymupdf(session, pg_num):
+    """
+    takes document session (see document_session.py) and page number
+    returns words on page (see module docstring) from pymupdf
+        boxes are a font size tall (as in pdfplumber) instead of pymupdf's ascender to descender
+    """
+    import pymupdf # current format dependency, only needed when this backend is used
+
+    # process wide setting, safe to flip since pymupdf only ever runs in one thread of a process
+    # (see write_pdf_vars_to_xlsx)
+    small_glyph_heights = pymupdf.TOOLS.set_small_glyph_heights()
+    pymupdf.TOOLS.set_small_glyph_heights(True)
+    try:
+        raw_words = session.document.load_page(pg_num).get_text('words')
+    finally:
+        pymupdf.TOOLS.set_small_glyph_heights(small_glyph_heights)
+
+    words = sorted(({'text': text, 'x0': x0, 'x1': x1, 'top': top, 'bottom': bottom}
+                    for x0, top, x1, bottom, text, *_ in raw_words), key=lambda word: word['top'])
+
+    # pymupdf orders words by text block, pdfplumber by line
+    lines = []
+    for word in words:
+        if lines and word['top'] - lines[-1][-1]['top'] <= LINE_TOLERANCE:
+            lines[-1].append(word)
+        else:
+            lines.append([word])
+
+    return [word for line in lines for word in sorted(line, key=lambda word: word['x0'])]
+
+# backend name -> function taking (document session, page number), returning words on page
+WORD_BACKENDS = {'pdfplumber': get_words_pdfplumber,
+                 'pymupdf': get_words_pymupdf}
+
+def check_word_backend(word_backend):
+    """
+    raises ValueError if word_backend is not a key of WORD_BACKENDS
+    """
+    if word_backend not in WORD_BACKENDS:
+        raise ValueError(f'unknown word backend: {word_backend} '
+                         f'(expected one of {', '.join(WORD_BACKENDS)})')
+
+def get_backend_stage(stage, word_backend):
+    """
+    takes name of a cached stage whose results depend on words, and word backend
+    returns name to cache it under, so results of different backends are kept apart
+        (default backend keeps the plain name, so existing cache entries stay valid)
+    """
+    if word_backend == DEFAULT_WORD_BACKEND:
+        return stage
+    return f'{stage}_{word_backend}'